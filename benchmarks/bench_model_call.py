@@ -0,0 +1,58 @@
+"""
+Microbenchmark of the per-call overhead of cassie.Model.__call__.
+
+The overhead is the time taken by a Model call beyond a direct call of the wrapped function,
+measured for a trivial model function so that the function body does not dominate. The
+argument handling used before call plans were precompiled is timed alongside for comparison.
+
+Run from the repository root with:
+    python benchmarks/bench_model_call.py
+"""
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import cassie
+
+
+def legacy_call(model, *args):
+    """The argument handling of Model.__call__ before call plans were precompiled"""
+    indices = list(range(model._argcount))
+    complete_args = [np.inf]*model._argcount
+    for parname in model._fixed_args:
+        idx = model._args.index(parname)
+        indices.remove(idx)
+        complete_args[idx] = model._fixed_args[parname]
+    for idx, arg in enumerate(args):
+        complete_args[indices[idx]] = arg
+    return model._func(*complete_args)
+
+
+def trivial(x, p = 0.5, q = 0.3, m0 = 803, m1 = 745, s0 = 15., s1 = 15, nbins = 1000):
+    return p
+
+
+def per_call(stmt, number):
+    """Best time per call of stmt, in seconds"""
+    return min(timeit.repeat(stmt, number = number, repeat = 5))/number
+
+
+def main(number = 200000):
+    model = cassie.Model(trivial)
+    model.fix_params(x = 1., q = 0.3, m0 = 803, m1 = 745, s0 = 15., s1 = 15, nbins = 1000)
+    args = (0.5,)
+
+    direct = per_call(lambda : trivial(1., 0.5, 0.3, 803, 745, 15., 15, 1000), number)
+    legacy = per_call(lambda : legacy_call(model, *args), number)
+    planned = per_call(lambda : model(*args), number)
+
+    print("Model.__call__ overhead per call (one free parameter, seven fixed)")
+    print("  legacy argument handling:\t{0:.3f} us".format((legacy - direct)*1e6))
+    print("  precompiled call plan:\t{0:.3f} us".format((planned - direct)*1e6))
+    print("  speedup:\t\t\t{0:.1f}x".format((legacy - direct)/max(planned - direct, 1e-12)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark suite for the cassie analysis pipeline, run against a synthetic scan.
+
+Times each stage of the pipeline - edge location, Model calls, likelihood estimation and
+default_process end to end - and reports its throughput, so that regressions in any stage show up.
+
+Run from the repository root with:
+    python benchmarks/bench_pipeline.py [--points N] [--shots N] [--samples N] [--hit-rate R]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import h5py as h5
+import cassie
+
+
+def best_time(func, repeat):
+    """Best wall time of repeat calls of func, in seconds"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def report(stage, seconds, count, unit):
+    print("{0:<36}{1:>10.4f} s{2:>14.4g} {3}/s".format(stage, seconds, count/seconds, unit))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark the cassie pipeline on a synthetic scan.")
+    parser.add_argument("--points", type = int, default = 41, help = "scan points (default: %(default)s)")
+    parser.add_argument("--shots", type = int, default = 250, help = "shots per scan point (default: %(default)s)")
+    parser.add_argument("--samples", type = int, default = 1000, help = "samples per trace (default: %(default)s)")
+    parser.add_argument("--hit-rate", type = float, default = 3., help = "mean hits per shot (default: %(default)s)")
+    parser.add_argument("--repeat", type = int, default = 3, help = "repeats of each timing (default: %(default)s)")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "bench_scan.h5")
+        started = time.perf_counter()
+        cassie.generate_scan(filename, points = np.linspace(0, 1, args.points), shots = args.shots,
+                             samples = args.samples, hit_rate = args.hit_rate, seed = args.seed)
+        generation = time.perf_counter() - started
+
+        with h5.File(filename, 'r') as f:
+            traces = f['osc_0'][:]
+        nshots = len(traces)
+        edges, offsets = cassie.locate_edges_batch(traces)
+
+        print("Synthetic scan: {0} points x {1} shots x {2} samples, {3} hits\n".format(
+            args.points, args.shots, args.samples, len(edges)))
+        print("{0:<36}{1:>12}{2:>20}".format("stage", "time", "throughput"))
+        report("generate_scan", generation, nshots, "shots")
+
+        # Edge location
+        report("locate_edges (per trace)", best_time(lambda : [cassie.locate_edges(trace) for trace in traces], args.repeat), nshots, "traces")
+        report("locate_edges_batch", best_time(lambda : cassie.locate_edges_batch(traces), args.repeat), nshots, "traces")
+
+        # Model calls, evaluated at every occupied time bin as in a binned fit
+        model = cassie.default_model
+        model.fix_params(x = np.unique(edges).reshape(1, -1), q = 0.74, m0 = 795., m1 = 736., s0 = 17., s1 = 11.)
+        ncalls = 2000
+        report("Model.__call__ (binned, p free)", best_time(lambda : [model(0.5) for _ in range(ncalls)], args.repeat), ncalls, "calls")
+        batch = np.full((ncalls, 1), 0.5)
+        report("Model.evaluate_batch (binned, p free)", best_time(lambda : model.evaluate_batch(batch), args.repeat), ncalls, "calls")
+        model.fix_params(x = None, q = None, m0 = None, m1 = None, s0 = None, s1 = None)
+
+        # Likelihood estimation
+        start = dict(p = 0.5, q = 0.5, m0 = 795., m1 = 739., s0 = 10., s1 = 20.)
+        for binned in (False, True):
+            mle = cassie.MaximumLikelihoodEstimator(model, binned = binned)
+            mle.set_data(edges)
+            label = "estimate (global, {0})".format("binned" if binned else "unbinned")
+            report(label, best_time(lambda : mle.estimate(**start), args.repeat), len(edges), "hits")
+
+        store = cassie.HitStore()
+        store.add(edges, offsets, np.repeat(np.linspace(0, 1, args.points), args.shots))
+        model.fix_params(q = 0.74, m0 = 795., m1 = 736., s0 = 17., s1 = 11.)
+        datasets = [store[idx] for idx in range(len(store))]
+        report("fit_points (per-point p)", best_time(lambda : cassie.fit_points(datasets, p0 = 0.5), args.repeat), len(datasets), "fits")
+        report("bootstrap_points (200 resamples)", best_time(lambda : cassie.bootstrap_points(datasets), args.repeat), len(datasets), "points")
+        model.fix_params(q = None, m0 = None, m1 = None, s0 = None, s1 = None)
+
+        # End to end, without and then with a sidecar hit index
+        report("default_process (no index)", best_time(lambda : cassie.default_process(filename, verbose = False, use_index = False), args.repeat), nshots, "shots")
+        cassie.default_process(filename, verbose = False)
+        report("default_process (indexed)", best_time(lambda : cassie.default_process(filename, verbose = False), args.repeat), nshots, "shots")
+        report("default_process (joint)", best_time(lambda : cassie.default_process(filename, verbose = False, joint = True), args.repeat), nshots, "shots")
+        report("default_process (bootstrap)", best_time(lambda : cassie.default_process(filename, verbose = False, uncertainty = 'bootstrap'), args.repeat), nshots, "shots")
+
+
+if __name__ == "__main__":
+    main()
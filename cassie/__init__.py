@@ -1 +1,2 @@
-from .cassie import *
\ No newline at end of file
+from .cassie import *
+from .synthetic import *
@@ -2,11 +2,16 @@ import warnings
 warnings.filterwarnings("ignore", category = FutureWarning)
 warnings.filterwarnings("ignore", category = UserWarning)
 
+import os
+import json
 import inspect
+import time
 import numpy as np
 import h5py as h5
 from scipy import optimize as opt
-from functools import update_wrapper
+from functools import update_wrapper, lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 
 
 def locate_edges(trace, val_threshold = 0.0005, grd_threshold = -0.0001):
@@ -26,6 +31,74 @@ def locate_edges(trace, val_threshold = 0.0005, grd_threshold = -0.0001):
     return edgelocs
 
 
+def locate_edges_batch(traces, val_threshold = 0.0005, grd_threshold = -0.0001):
+    """
+    Returns the indices of each falling edge in every trace of a 2D array of traces,
+    with shape (n_traces, n_samples), in a single vectorised pass.
+
+    The result is a tuple (edges, offsets): edges is a flat array of the edge indices of
+    all traces, in trace order, and the edges of trace k are edges[offsets[k]:offsets[k+1]].
+    The edges found for each trace are identical to those found by locate_edges.
+    """
+    traces = np.asarray(traces)
+    if traces.ndim != 2:
+        raise ValueError("Expected a 2D array of traces with shape (n_traces, n_samples).")
+
+    med = np.median(traces, axis = 1, keepdims = True) #Per-trace baseline
+
+    edge = (np.gradient(traces, axis = 1) < grd_threshold)*(traces < med - val_threshold)
+
+    #An edge is entered where edge is set but was not set at the previous sample.
+    #As in locate_edges, entries at the first two samples of a trace are not counted.
+    entry = edge[:, 2:] & ~edge[:, 1:-1]
+    rows, cols = np.nonzero(entry)
+
+    offsets = np.zeros(len(traces) + 1, dtype = np.intp)
+    np.cumsum(np.bincount(rows, minlength = len(traces)), out = offsets[1:])
+    return cols + 2, offsets
+
+
+def iter_chunks(dataset, max_bytes = 2**26, start = 0, stop = None):
+    """
+    Generator walking the rows dataset[start:stop] of an HDF5 dataset in blocks, yielding
+    (start, block) pairs where block holds the rows dataset[start:start+len(block)].
+
+    Blocks are aligned to the chunk layout of the dataset (if it is chunked) and are read into
+    a single reused buffer of no more than max_bytes, so that memory use is independent of the
+    size of the dataset. A block always holds at least one row, or one chunk of rows.
+    The buffer is overwritten on each iteration: copy any block that must outlive it.
+    """
+    stop = dataset.shape[0] if stop is None else min(stop, dataset.shape[0])
+    if stop <= start:
+        return
+
+    row_bytes = max(dataset.dtype.itemsize*int(np.prod(dataset.shape[1:])), 1)
+    step = max(1, int(max_bytes//row_bytes))
+
+    #Read whole chunks only, so that no chunk is decompressed more than once
+    if dataset.chunks is not None:
+        chunk_rows = dataset.chunks[0]
+        step = max(chunk_rows, step - step % chunk_rows)
+
+    buffer = np.empty((min(step, stop - start),) + dataset.shape[1:], dtype = dataset.dtype)
+
+    while start < stop:
+        block_stop = min((start//step + 1)*step, stop)
+        dataset.read_direct(buffer, np.s_[start:block_stop], np.s_[0:block_stop - start])
+        yield start, buffer[:block_stop - start]
+        start = block_stop
+
+
+def scan_column(dataset, column = 0, start = 0, stop = None):
+    """
+    Returns a single column of the rows dataset[start:stop] of a scan dataset, such as the independent
+    variable in the first column of the analysis dataset. Both compound and 2D datasets are supported.
+    """
+    if dataset.dtype.names:
+        return dataset[start:stop][dataset.dtype.names[column]]
+    return dataset[start:stop, column]
+
+
 def locate_outliers(data, z = 1, axis = None):
     """Returns the indices of outliers in data, identified by z-score"""
     mu = np.mean(data, axis = axis)
@@ -34,6 +107,370 @@ def locate_outliers(data, z = 1, axis = None):
     return indices
 
 
+def memoize(maxsize = 128):
+    """
+    Decorator to cache the results of a function of model parameters, for precomputations within a
+    model (such as normalisation constants) which depend on parameter values but not on the data.
+
+    At most maxsize results are retained, discarding the least recently used. Calls with unhashable
+    arguments, such as arrays, bypass the cache. Cached results are shared between calls, so must
+    not be modified in place.
+    """
+
+    def decorator(func):
+        cached = lru_cache(maxsize = maxsize)(func)
+
+        def wrapper(*args):
+            try:
+                hash(args)
+            except TypeError:
+                return func(*args)
+            return cached(*args)
+
+        update_wrapper(wrapper, func)
+        wrapper.cache_info = cached.cache_info
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+
+    return decorator
+
+
+class HitStore():
+    """
+    Compact storage for the hits recorded at each point of a scan: a single contiguous array of
+    hit times, grouped by scan point, and the offsets of each point's hits within it.
+    """
+
+
+    def __init__(self, dtype = np.int32):
+        """
+        dtype : numpy dtype
+        The integer type used to store hit times.
+        """
+
+        self._dtype = dtype
+
+        #Blocks of hits as added, grouped by scan point only when the hits are requested
+        self._blocks = []
+        self._trace_counts = []
+        self._trace_values = []
+        self._grouped = None
+
+
+    def add(self, edges, offsets, values):
+        """
+        Add the hits found in a block of traces.
+
+        edges, offsets : array
+        Flat hit times and per-trace offsets, as returned by locate_edges_batch.
+
+        values : array
+        The value of the independent variable for each trace in the block.
+        """
+
+        counts = np.diff(offsets)
+        if len(counts) != len(values):
+            raise ValueError("Expected one independent variable value per trace: got {0} values for {1} traces.".format(len(values), len(counts)))
+
+        self._blocks.append(np.asarray(edges[offsets[0]:offsets[-1]], dtype = self._dtype))
+        self._trace_counts.append(counts)
+        self._trace_values.append(np.asarray(values))
+        self._grouped = None
+
+
+    def _group(self):
+        """
+        Sort the hits of every trace added so far by scan point, keeping the order of traces at each point.
+        """
+
+        if self._grouped is not None:
+            return self._grouped
+
+        if not self._blocks:
+            self._grouped = (np.zeros(0), np.zeros(1, dtype = np.intp), np.zeros(0, dtype = self._dtype))
+            return self._grouped
+
+        #A single block, such as a memory-mapped hit index, is used as it is rather than copied
+        hits = self._blocks[0] if len(self._blocks) == 1 else np.concatenate(self._blocks)
+        counts = np.concatenate(self._trace_counts)
+        points, inverse = np.unique(np.concatenate(self._trace_values), return_inverse = True)
+
+        #Gather the hits of each trace in order of scan point, unless the traces are already in that order
+        if np.any(np.diff(inverse) < 0):
+            order = np.argsort(inverse, kind = 'stable')
+            trace_starts = np.cumsum(counts) - counts
+            sorted_counts = counts[order]
+            sorted_starts = np.cumsum(sorted_counts) - sorted_counts
+            gather = np.repeat(trace_starts[order] - sorted_starts, sorted_counts) + np.arange(len(hits))
+            hits = hits[gather]
+
+        point_counts = np.bincount(inverse, weights = counts, minlength = len(points)).astype(np.intp)
+        offsets = np.zeros(len(points) + 1, dtype = np.intp)
+        np.cumsum(point_counts, out = offsets[1:])
+
+        #Keep the grouped hits as a single block holding every trace at each point,
+        #so that memory is not held twice and later blocks are grouped in with them
+        self._blocks = [hits]
+        self._trace_counts = [point_counts]
+        self._trace_values = [points]
+        self._grouped = (points, offsets, hits)
+        return self._grouped
+
+
+    def get_points(self):
+        """
+        Returns the sorted, unique values of the independent variable.
+        """
+        return self._group()[0]
+
+
+    def get_offsets(self):
+        """
+        Returns the offsets of the hits at each point, such that the hits at point k are hits[offsets[k]:offsets[k+1]].
+        """
+        return self._group()[1]
+
+
+    def get_hits(self):
+        """
+        Returns the contiguous array of all hits, grouped by scan point.
+        """
+        return self._group()[2]
+
+
+    def __len__(self):
+        return len(self.get_points())
+
+
+    def __getitem__(self, idx):
+        """
+        Returns a view of the hits at point idx, without copying.
+        """
+        points, offsets, hits = self._group()
+        return hits[offsets[idx]:offsets[idx+1]]
+
+
+def hit_index_key(filename, shape, val_threshold = 0.0005, grd_threshold = -0.0001):
+    """
+    Returns the key identifying the hits found in the osc_0 dataset of filename, of the given shape,
+    with the given edge detection thresholds. The key changes whenever the file is modified.
+    """
+    stat = os.stat(filename)
+    return {
+        'version' : 1,
+        'size' : stat.st_size,
+        'mtime_ns' : stat.st_mtime_ns,
+        'shape' : [int(n) for n in shape],
+        'val_threshold' : val_threshold,
+        'grd_threshold' : grd_threshold
+        }
+
+
+def load_hit_index(filename, key):
+    """
+    Returns the per-trace hits (edges, offsets) stored in the sidecar hit index of filename, memory-mapped
+    without copying, or None if there is no index or it was not written with the given key.
+    """
+    index = filename + '.hits'
+    try:
+        with open(os.path.join(index, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        if meta['key'] != key:
+            return None
+        edges = np.memmap(os.path.join(index, 'edges.bin'), dtype = np.int32, mode = 'r', shape = (meta['nhits'],)) if meta['nhits'] else np.zeros(0, dtype = np.int32)
+        offsets = np.memmap(os.path.join(index, 'offsets.bin'), dtype = np.int64, mode = 'r', shape = (meta['ntraces'] + 1,))
+    except (OSError, ValueError, KeyError):
+        return None
+    return edges, offsets
+
+
+class HitIndexWriter():
+    """
+    Class to write the sidecar hit index of a scan file block by block, as edges are located,
+    so that later analysis of the same file can skip edge detection.
+    """
+
+
+    def __init__(self, filename, key):
+        """
+        filename : str
+        The scan file being indexed. The index is written to the directory filename + '.hits'.
+
+        key : dict
+        The key of the hits being indexed, as returned by hit_index_key.
+        """
+
+        self._index = filename + '.hits'
+        self._key = key
+        self._nhits = 0
+        self._ntraces = 0
+
+        os.makedirs(self._index, exist_ok = True)
+
+        #Invalidate any existing index before overwriting it
+        meta = os.path.join(self._index, 'meta.json')
+        if os.path.exists(meta):
+            os.remove(meta)
+
+        self._edges = open(os.path.join(self._index, 'edges.bin'), 'wb')
+        self._offsets = open(os.path.join(self._index, 'offsets.bin'), 'wb')
+        self._offsets.write(np.zeros(1, dtype = np.int64).tobytes())
+
+
+    def add(self, edges, offsets):
+        """
+        Append the hits found in the next block of traces, as returned by locate_edges_batch.
+        """
+        self._edges.write(np.asarray(edges[offsets[0]:offsets[-1]], dtype = np.int32).tobytes())
+        self._offsets.write((np.asarray(offsets[1:], dtype = np.int64) - offsets[0] + self._nhits).tobytes())
+        self._nhits += int(offsets[-1] - offsets[0])
+        self._ntraces += len(offsets) - 1
+
+
+    def close(self, complete = True):
+        """
+        Close the index, marking it valid if complete is True. An index closed incomplete is ignored, and
+        errors in closing it are not raised.
+        """
+        errors = []
+        for stream in (self._edges, self._offsets):
+            try:
+                stream.close()
+            except OSError as e:
+                errors.append(e)
+        if not complete:
+            return
+        if errors:
+            raise errors[0]
+        with open(os.path.join(self._index, 'meta.json'), 'w') as meta_file:
+            json.dump({'key' : self._key, 'nhits' : self._nhits, 'ntraces' : self._ntraces}, meta_file)
+
+
+class FitResult():
+    """
+    The outcome of a single maximum likelihood fit. A FitResult unpacks as (popt, pcov), and also
+    records how the fit went, for diagnosing slow or failed fits.
+    """
+
+
+    def __init__(self, popt, pcov, names, success = True, status = 0, message = "", nfev = 0, njev = 0, nit = 0, timings = None):
+        """
+        popt, pcov : array
+        The estimated parameter values and their covariance. Both are NaN if the fit failed.
+
+        names : list of str
+        The names of the estimated parameters.
+
+        success, status, message
+        The convergence status reported by the optimiser, or the exception raised during optimisation.
+
+        nfev, njev, nit : int
+        The number of objective and gradient evaluations, and optimiser iterations.
+
+        timings : dict
+        The wall time in seconds spent in each stage of the fit: setup, optimise and covariance.
+        """
+        self.popt = popt
+        self.pcov = pcov
+        self.names = names
+        self.success = success
+        self.status = status
+        self.message = message
+        self.nfev = nfev
+        self.njev = njev
+        self.nit = nit
+        self.timings = {} if timings is None else timings
+        self.tag = None #Set by callers to identify the fit, such as by its scan point
+
+
+    def __iter__(self):
+        return iter((self.popt, self.pcov))
+
+
+    def elapsed(self):
+        """
+        Returns the total wall time of the fit in seconds.
+        """
+        return sum(self.timings.values())
+
+
+    def __repr__(self):
+        return "FitResult(tag={0!r}, success={1}, nfev={2}, njev={3}, nit={4}, elapsed={5:.4g}s, message={6!r})".format(
+            self.tag, self.success, self.nfev, self.njev, self.nit, self.elapsed(), self.message)
+
+
+class FitRecorder():
+    """
+    A fit hook which keeps every FitResult passed to it, for aggregating statistics across many fits.
+    """
+
+
+    def __init__(self):
+        self.results = []
+
+
+    def __call__(self, result):
+        self.results.append(result)
+
+
+    def summary(self):
+        """
+        Returns a dictionary of totals over all recorded fits: the number of fits and failures, the
+        objective and gradient evaluations, optimiser iterations, and wall time spent in each stage.
+        """
+        timings = {}
+        for result in self.results:
+            for stage, seconds in result.timings.items():
+                timings[stage] = timings.get(stage, 0.) + seconds
+
+        return {
+            'fits' : len(self.results),
+            'failures' : sum(not result.success for result in self.results),
+            'nfev' : sum(result.nfev for result in self.results),
+            'njev' : sum(result.njev for result in self.results),
+            'nit' : sum(result.nit for result in self.results),
+            'timings' : timings
+            }
+
+
+    def slowest(self, n = 10):
+        """
+        Returns the n recorded fits which took the longest, slowest first.
+        """
+        return sorted(self.results, key = lambda result : result.elapsed(), reverse = True)[:n]
+
+
+def _observed_covariance(objective, jac, x, bounds):
+    """
+    Returns the inverse of the Hessian of objective, a negative log-likelihood, at its minimum x: the covariance
+    of the estimates from the observed information. The Hessian is found by central differences of the gradient
+    jac, or of a central difference gradient of objective if jac is not callable, stepping to one side only
+    where x lies on one of its bounds. If the Hessian is singular, the covariance is NaN.
+    """
+    x = np.asarray(x, dtype = float)
+    lower = np.array([-np.inf if bound is None or bound[0] is None else bound[0] for bound in bounds])
+    upper = np.array([np.inf if bound is None or bound[1] is None else bound[1] for bound in bounds])
+
+    def difference(f, theta, k, step):
+        #Derivative of f along parameter k, over a step either side of theta that stays within the bounds
+        hi, lo = theta.copy(), theta.copy()
+        hi[k] = min(theta[k] + step[k], upper[k])
+        lo[k] = max(theta[k] - step[k], lower[k])
+        return (np.asarray(f(hi)) - np.asarray(f(lo)))/(hi[k] - lo[k])
+
+    if callable(jac):
+        step = np.finfo(float).eps**(1/3)*np.maximum(np.abs(x), 1)
+    else:
+        step = np.finfo(float).eps**(1/4)*np.maximum(np.abs(x), 1)
+        jac = lambda theta : np.array([difference(objective, theta, k, step) for k in range(len(theta))])
+
+    hessian = np.column_stack([difference(jac, x, k, step) for k in range(len(x))])
+    try:
+        return np.linalg.inv(0.5*(hessian + hessian.T))
+    except np.linalg.LinAlgError:
+        return np.full((len(x), len(x)), np.nan)
+
+
 class MaximumLikelihoodEstimator():
     """
     Class to perform maximum likelihood estimation of parameter values
@@ -41,10 +478,15 @@ class MaximumLikelihoodEstimator():
     """
 
 
-    def __init__(self, model):
+    def __init__(self, model, binned = False):
         """
         model : callable
         A Model object (or callable than can be wrapped by the Model class)
+
+        binned : bool
+        If True, the data must be non-negative integers (such as time bins). The data are
+        histogrammed once when assigned, and the likelihood is evaluated once per occupied bin,
+        weighted by its count, rather than once per datum.
         """
 
         # Create a Model using the supplied callable if it is not already a Model
@@ -57,8 +499,77 @@ class MaximumLikelihoodEstimator():
         else:
             raise TypeError("Hypothesis model must be callable.")
         
+        self._binned = binned
+        self._hooks = []
+
         #Initialise data to None - must be assigned later
         self._data = None
+        self._bins = None
+        self._counts = None
+
+
+    def add_hook(self, hook):
+        """
+        Register a callable to be passed the FitResult of every subsequent fit, such as a FitRecorder.
+        """
+        self._hooks.append(hook)
+
+
+    def remove_hook(self, hook):
+        """
+        Stop passing fit results to a previously registered hook.
+        """
+        self._hooks.remove(hook)
+
+
+    def _minimize(self, minimize_me, jac, init_params, param_bounds, names, timings, started):
+        """
+        Minimise the negative log-likelihood, counting evaluations and timing the optimisation.
+        Returns the optimiser result, or a failed FitResult if optimisation raised an exception.
+        """
+
+        evaluations = {'nfev' : 0, 'njev' : 0}
+
+        def counted_objective(args):
+            evaluations['nfev'] += 1
+            return minimize_me(args)
+
+        counted_jac = jac
+        if callable(jac):
+            def counted_jac(args):
+                evaluations['njev'] += 1
+                return jac(args)
+
+        timings['setup'] = time.perf_counter() - started
+        started = time.perf_counter()
+        try:
+            result = opt.minimize(counted_objective, init_params, bounds=param_bounds, jac=counted_jac)
+        except Exception as e:
+            timings['optimise'] = time.perf_counter() - started
+            nan = np.full(len(init_params), np.nan)
+            return FitResult(nan, np.outer(nan, nan), names, success = False, status = -1, message = str(e),
+                             nfev = evaluations['nfev'], njev = evaluations['njev'], timings = timings)
+
+        timings['optimise'] = time.perf_counter() - started
+        result.nfev = evaluations['nfev']
+        result.njev = evaluations['njev'] if callable(jac) else result.njev
+        return result
+
+
+    def _report(self, result, names, pcov, timings, started):
+        """
+        Package an optimiser result as a FitResult and pass it to every hook.
+        """
+
+        if not isinstance(result, FitResult):
+            timings['covariance'] = time.perf_counter() - started
+            result = FitResult(result.x, pcov, names, success = result.success, status = result.status,
+                               message = str(result.message), nfev = result.nfev, njev = result.njev,
+                               nit = result.nit, timings = timings)
+
+        for hook in self._hooks:
+            hook(result)
+        return result
 
 
     def estimate(self, **kwargs):
@@ -66,8 +577,13 @@ class MaximumLikelihoodEstimator():
         Estimate the value of the named parameters, given the data assigned to the
         MaximumLikelihoodEstimator. The value assigned to the named parameters given
         as arguments is taken as an initial estimate of the maximum likelihood value.
+
+        Returns a FitResult, which unpacks as the estimated values and their covariance.
         """
 
+        started = time.perf_counter()
+        timings = {}
+
         # Check that data has been assigned to the estimator
         if (self._data is None) or (not np.shape(self._data)):
             raise ValueError("No data found: please provide data with the set_data() method before attempting to estimate parameters.")
@@ -82,7 +598,12 @@ class MaximumLikelihoodEstimator():
         #And mark any arguments not explicitly fixed as free
         to_release = {name:None for name in self._m.get_param_names() if name not in init_fixes}
 
-        data_fix = {self._m.get_param_names()[0] : np.array(self._data).reshape((1, -1))}
+        if self._binned:
+            data_fix = {self._m.get_param_names()[0] : self._bins.reshape((1, -1))}
+            weights = self._counts.reshape((1, -1))
+        else:
+            data_fix = {self._m.get_param_names()[0] : np.asarray(self._data).reshape((1, -1))}
+            weights = 1
         return_test_fix = {self._m.get_param_names()[0] : np.median(self._data)}
         self._m.fix_params(**return_test_fix)
 
@@ -101,48 +622,329 @@ class MaximumLikelihoodEstimator():
         
         self._m.fix_params(**data_fix)
         
+        jac = '3-point'
         if return_shape:
-            minimize_me = lambda args : -np.sum(np.log(self._m(*args)[0]))
+            minimize_me = lambda args : -np.sum(weights*np.log(self._m(*args)[0]))
         else:
-            minimize_me = lambda args : -np.sum(np.log(self._m(*args)))
+            minimize_me = lambda args : -np.sum(weights*np.log(self._m(*args)))
 
-        try:
-            result = opt.minimize(minimize_me, init_params, bounds=param_bounds, jac='3-point') ### Should release parameters if this fails
-        except Exception as e:
+            #Use the analytic gradient of the model where one is available
+            if self._m.has_gradient():
+                jac = lambda args : -np.array([np.sum(weights*partial) for partial in self._m.log_gradient(*args)])
+
+        names = [name for name in self._m.get_param_names() if name in kwargs]
+        result = self._minimize(minimize_me, jac, init_params, param_bounds, names, timings, started)
+        started = time.perf_counter()
+
+        if isinstance(result, FitResult):
             self._m.fix_params(**to_release)
-            print("An exception occurred during likelihood optimisation:")
-            print(e)
-            return
+            return self._report(result, names, None, timings, started)
         
         if return_shape:
             cov = self._m(*result.x)[1]
             self._m.fix_params(**to_release)
             free_idxs = [self._m.get_param_names().index(key)-1 for key in kwargs]
             subcov = cov[np.ix_(free_idxs, free_idxs)]
-            return result.x, subcov
+            return self._report(result, names, subcov, timings, started)
+
+        self._m.fix_params(**to_release)
+        return self._report(result, names, result.hess_inv.todense(), timings, started)
+
+
+    def estimate_joint(self, offsets, vary = ('p',), **kwargs):
+        """
+        Jointly estimate the value of the named parameters across groups of the data assigned to the
+        MaximumLikelihoodEstimator, such as the hits at each point of a scan, in a single optimisation.
+        Parameters named in vary take a separate value for each group, while the others are shared.
+
+        offsets : sequence of int
+        Group boundaries, such that group k is data[offsets[k]:offsets[k+1]].
+
+        vary : sequence of str
+        Names of the parameters that take a separate value for each group. Their initial estimates may be
+        given as a single value or one value per group. The model must broadcast over these parameters.
+
+        Returns a FitResult, which unpacks as the estimated parameter vector, holding the shared parameters in
+        model order followed by the values of each varying parameter for every group, and its covariance matrix.
+        """
+
+        started = time.perf_counter()
+        timings = {}
+
+        # Check that data has been assigned to the estimator
+        if (self._data is None) or (not np.shape(self._data)):
+            raise ValueError("No data found: please provide data with the set_data() method before attempting to estimate parameters.")
+
+        offsets = np.asarray(offsets)
+        ngroups = len(offsets) - 1
+        group = np.repeat(np.arange(ngroups), np.diff(offsets))
+
+        # Lay the data out so that a single model call evaluates every group
+        if self._binned:
+            data = np.ravel(self._data).astype(np.intp)
+            nbins = data.max() + 1 if data.size else 0
+            counts = np.bincount(group*nbins + data, minlength = ngroups*nbins).reshape((ngroups, nbins))
+            occupied = np.flatnonzero(counts.any(axis = 0))
+            points, weights = occupied.reshape((1, -1)), counts[:, occupied]
+            expand = lambda values : values.reshape((-1, 1))
+            group_sum = lambda values : np.sum(values, axis = 1)
+        else:
+            points, weights = np.ravel(self._data), 1
+            expand = lambda values : values[group]
+            group_sum = lambda values : np.bincount(group, weights = values, minlength = ngroups)
+
+        names = self._m.get_param_names()
+        init_fixes = self._m.get_fixed_params()
+        to_release = {name:None for name in names if name not in init_fixes}
+
+        shared = [name for name in names if name in kwargs and name not in vary]
+        joint_fixes = self._m.get_param_defaults()
+        joint_fixes.update(init_fixes)
+        joint_fixes = {key : value for key, value in joint_fixes.items() if not key in kwargs}
+        joint_fixes[names[0]] = points
+        self._m.fix_params(**joint_fixes)
+        self._m.fix_params(**{key : None for key in kwargs})
+
+        free = [name for name in names if name in kwargs]
+        nshared = len(shared)
+
+        def unpack(theta):
+            args, k = [], nshared
+            for name in free:
+                if name in vary:
+                    args.append(expand(theta[k:k + ngroups]))
+                    k += ngroups
+                else:
+                    args.append(theta[shared.index(name)])
+            return args
+
+        bounds = self._m.get_param_bounds()
+        param_bounds = [bounds[name] for name in shared]
+        init_params = [kwargs[name] for name in shared]
+        for name in free:
+            if name in vary:
+                param_bounds += [bounds[name]]*ngroups
+                init_params += list(np.broadcast_to(kwargs[name], (ngroups,)))
+
+        minimize_me = lambda theta : -np.sum(weights*np.log(self._m(*unpack(theta))))
+
+        jac = '3-point'
+        if self._m.has_gradient():
+            def jac(theta):
+                partials = self._m.log_gradient(*unpack(theta))
+                grad_shared = [np.sum(weights*partials[free.index(name)]) for name in shared]
+                grad_vary = [group_sum(weights*partials[free.index(name)]) for name in free if name in vary]
+                return -np.concatenate([grad_shared] + grad_vary)
 
+        names = shared + ["{0}[{1}]".format(name, k) for name in free if name in vary for k in range(ngroups)]
+        result = self._minimize(minimize_me, jac, init_params, param_bounds, names, timings, started)
+        started = time.perf_counter()
+
+        if isinstance(result, FitResult):
+            self._m.fix_params(**to_release)
+            return self._report(result, names, None, timings, started)
+
+        #The inverse Hessian approximation of L-BFGS-B is of too low a rank to serve as the covariance of many
+        #parameters, so the covariance is found from the observed information instead
+        pcov = _observed_covariance(minimize_me, jac, result.x, param_bounds)
         self._m.fix_params(**to_release)
-        return result.x, result.hess_inv.todense()
+        return self._report(result, names, pcov, timings, started)
+
+
+    def _log_prob(self, name, values):
+        """
+        Returns the weight of each datum (or occupied bin) and the log of the model for each of them, with one
+        column for each of the given values of the named parameter, evaluated in a single call of the model.
+        """
+
+        if (self._data is None) or (not np.shape(self._data)):
+            raise ValueError("No data found: please provide data with the set_data() method before evaluating the likelihood.")
+
+        if self._binned:
+            points, weights = self._bins.reshape((-1, 1)), self._counts
+        else:
+            points = np.reshape(self._data, (-1, 1))
+            weights = np.ones(len(points), dtype = np.intp)
+
+        init_fixes = self._m.get_fixed_params()
+        profile_fixes = self._m.get_param_defaults()
+        profile_fixes.update(init_fixes)
+        profile_fixes.update({self._m.get_param_names()[0] : points, name : None})
+
+        self._m.fix_params(**profile_fixes)
+        try:
+            prob = self._m(np.reshape(values, (1, -1)))
+        finally:
+            self._m.fix_params(**{key : None for key in profile_fixes})
+            self._m.fix_params(**init_fixes)
+
+        return weights, np.log(prob)
+
+
+    def profile(self, name, values):
+        """
+        Returns the log-likelihood of the data assigned to the MaximumLikelihoodEstimator at each of the given
+        values of the named parameter, with every other parameter at its fixed value (or otherwise its default).
+        All values are evaluated in a single call of the model, which must broadcast over the named parameter.
+        """
+
+        weights, logprob = self._log_prob(name, values)
+        return np.sum(weights.reshape((-1, 1))*logprob, axis = 0)
+
+
+    def grid_search(self, max_bytes = 2**24, **kwargs):
+        """
+        Evaluate the log-likelihood of the data assigned to the MaximumLikelihoodEstimator at every combination
+        of the candidate values given for the named parameters, with every other parameter at its fixed value
+        (or otherwise its default), for example to choose starting values for estimate().
+
+        The combinations are evaluated in batches with Model.evaluate_batch(), so a vectorised model evaluates
+        each batch in a single call. Batches are limited to roughly max_bytes bytes of model output.
+
+        kwargs
+        The names of parameters, and a value or sequence of candidate values for each.
+
+        Returns a dictionary of the best combination of values, and the log-likelihood of every combination,
+        with one axis per named parameter in the order given.
+        """
+
+        if (self._data is None) or (not np.shape(self._data)):
+            raise ValueError("No data found: please provide data with the set_data() method before evaluating the likelihood.")
+
+        if self._binned:
+            points, weights = self._bins, self._counts
+        else:
+            points, weights = np.ravel(self._data), np.ones(np.size(self._data))
+
+        unknown = [name for name in kwargs if name not in self._m.get_param_names()[1:]]
+        if unknown:
+            raise ValueError("Unknown parameter(s) {0}: expected any of {1}".format(unknown, self._m.get_param_names()[1:]))
+
+        names = [name for name in self._m.get_param_names() if name in kwargs]
+        grids = np.meshgrid(*[np.atleast_1d(kwargs[name]) for name in names], indexing = 'ij')
+        candidates = np.column_stack([grid.ravel() for grid in grids])
+
+        init_fixes = self._m.get_fixed_params()
+        search_fixes = self._m.get_param_defaults()
+        search_fixes.update(init_fixes)
+        search_fixes.update({self._m.get_param_names()[0] : points})
+        search_fixes.update({name : None for name in names})
+
+        loglike = np.empty(len(candidates))
+        batch = max(1, max_bytes//(8*max(1, len(points))))
+
+        self._m.fix_params(**search_fixes)
+        try:
+            for start in range(0, len(candidates), batch):
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    logprob = np.log(self._m.evaluate_batch(candidates[start:start + batch]))
+                loglike[start:start + batch] = logprob.reshape((len(logprob), -1)) @ weights
+        finally:
+            self._m.fix_params(**{key : None for key in search_fixes})
+            self._m.fix_params(**init_fixes)
+
+        loglike[np.isnan(loglike)] = -np.inf
+        best = dict(zip(names, candidates[np.argmax(loglike)]))
+        return best, np.transpose(loglike.reshape(grids[0].shape), [names.index(name) for name in kwargs])
+
+
+    def bootstrap(self, name, values, n_resamples = 200, rng = None):
+        """
+        Estimate the named parameter, and the spread of that estimate, by bootstrap resampling of the data
+        assigned to the MaximumLikelihoodEstimator. Every other parameter is held at its fixed value (or
+        otherwise its default), so the model must broadcast over the named parameter as for profile().
+
+        Each resample redraws the counts of the data (or of the occupied bins, if binned) from a multinomial
+        distribution, so the log-likelihood of every resample at every value is a single matrix product.
+        Each estimate is the best of the given values, refined by a parabola through its neighbours.
+
+        values : sequence of float
+        Grid of values of the named parameter, in increasing order.
+
+        n_resamples : int
+        Number of bootstrap resamples to draw.
+
+        rng : numpy.random.Generator, int or None
+        Source of the resamples, or a seed for one.
+
+        Returns the estimate from the data and an array of the estimates from each resample, whose standard
+        deviation is the bootstrap uncertainty of the estimate. If there is no data, every estimate is NaN.
+        """
+
+        values = np.asarray(values, dtype = float)
+        if values.ndim != 1 or len(values) < 3:
+            raise ValueError("Bootstrap estimation requires a one-dimensional grid of at least three values.")
+
+        rng = np.random.default_rng(rng)
+        weights, logprob = self._log_prob(name, values)
+
+        #The data itself followed by each of its resamples, one per row
+        total = np.sum(weights)
+        if total == 0:
+            return np.nan, np.full(n_resamples, np.nan)
+        counts = np.vstack((weights, rng.multinomial(total, weights/total, size = n_resamples)))
+
+        #Unoccupied values contribute nothing, even where the model vanishes
+        finite = np.isfinite(logprob)
+        loglike = counts @ np.where(finite, logprob, 0.)
+        loglike[(counts @ ~finite) > 0] = -np.inf
+
+        best = np.argmax(loglike, axis = 1)
+        idx = np.clip(best, 1, len(values) - 2)
+        rows = np.arange(len(counts))
+        x0, x1, x2 = values[idx - 1], values[idx], values[idx + 1]
+        y0, y1, y2 = loglike[rows, idx - 1], loglike[rows, idx], loglike[rows, idx + 1]
+
+        #Vertex of the parabola through the best value and its neighbours, where it is a maximum
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            num = (x1 - x0)**2*(y1 - y2) - (x1 - x2)**2*(y1 - y0)
+            den = (x1 - x0)*(y1 - y2) - (x1 - x2)*(y1 - y0)
+            vertex = x1 - 0.5*num/den
+            curvature = (y2 - y1)/(x2 - x1) - (y1 - y0)/(x1 - x0)
+        refine = (best == idx) & np.isfinite(vertex) & (curvature < 0) & (vertex >= x0) & (vertex <= x2)
+        estimates = np.where(refine, vertex, values[best])
+
+        return estimates[0], estimates[1:]
 
 
     def set_data(self, data):
         self._data = data
 
+        if self._binned:
+            data = np.ravel(data)
+            if not np.issubdtype(data.dtype, np.integer):
+                if np.any(data != np.round(data)):
+                    raise ValueError("Binned likelihood estimation requires integer-valued data.")
+                data = data.astype(np.intp)
+
+            #Histogram the data once, keeping only the occupied bins
+            counts = np.bincount(data) if data.size else np.zeros(0, dtype = np.intp)
+            self._bins = np.flatnonzero(counts)
+            self._counts = counts[self._bins]
+
 
 class Model():
     """A class for representing statistical models through functions."""
 
 
-    def __init__(self, modelfunc):
+    def __init__(self, modelfunc, gradient = None, vectorised = False):
         """
         modelfunc : Callable
         A callable which, given its parameters and arguments, returns the probability of observing
         those arguments for those parameters according to the model it represents.
+
+        gradient : Callable or None
+        An optional callable with the same signature as modelfunc, see set_gradient().
+
+        vectorised : bool
+        Whether modelfunc broadcasts over a leading batch axis of its parameters, see set_vectorised().
         """
         
         update_wrapper(self, modelfunc) #Cleanly wrap the model function
 
         self._func = modelfunc
+        self._gradient = gradient
+        self._vectorised = vectorised
 
         argspec = inspect.getfullargspec(modelfunc) #Function inspection - get parameter names and defaults
         self._args = argspec.args[:]
@@ -156,6 +958,8 @@ class Model():
         self._fixed_args = {} #Initially none of the model's argument values are fixed
         self._bounds = {arg:(None, None) for arg in self._args} #And no bounds are placed on the possible values
 
+        self._compile_call_plan()
+
 
     def fix_params(self, **kwargs):
         """
@@ -166,6 +970,10 @@ class Model():
         If a value of None is given, the argument with that name will be free.
         """
 
+        unknown = [name for name in kwargs if name not in self._args]
+        if unknown:
+            raise ValueError("Unknown parameter(s) {0}: expected any of {1}".format(unknown, self._args))
+
         self._fixed_args.update(kwargs) #Update internal dictionary of fixed arguments
         
         #Collecting a list of all parameters to be released
@@ -178,6 +986,17 @@ class Model():
         for arg in released_params:
             del self._fixed_args[arg]
 
+        self._compile_call_plan()
+
+
+    def _compile_call_plan(self):
+        """
+        Precompute how supplied arguments are combined with fixed arguments, so that each call only has to
+        place the supplied values into a copy of a template holding the fixed values.
+        """
+        self._free_idxs = tuple(idx for idx, name in enumerate(self._args) if name not in self._fixed_args)
+        self._template = [self._fixed_args.get(name, np.inf) for name in self._args]
+
 
     def set_defaults(self, **kwargs):
         """
@@ -202,31 +1021,112 @@ class Model():
         self._bounds.update(kwargs)
 
 
+    def set_gradient(self, gradient):
+        """
+        Method to supply the analytic gradient of the log of the model.
+
+        gradient : Callable or None
+        A callable with the same signature as the model function, returning a dictionary which maps
+        parameter names to the partial derivative of the log of the model with respect to that parameter,
+        each with the same shape as the model's output. If None, any existing gradient is removed.
+        """
+        self._gradient = gradient
+
+
+    def has_gradient(self):
+        """
+        Returns True if an analytic gradient has been supplied for this model.
+        """
+        return self._gradient is not None
+
+
+    def log_gradient(self, *args):
+        """
+        Returns a list of the partial derivatives of the log of the model with respect to each free
+        parameter, in parameter order, using a combination of supplied and fixed arguments.
+        """
+
+        if self._gradient is None:
+            raise TypeError("No gradient has been supplied for this model: see set_gradient().")
+
+        partials = self._gradient(*self._complete_args(args))
+
+        try:
+            return [partials[self._args[idx]] for idx in self._free_idxs]
+        except KeyError as e:
+            raise ValueError("The gradient of this model does not include the free parameter {0}.".format(e))
+
+
+    def set_vectorised(self, vectorised = True):
+        """
+        Method to declare whether the model function broadcasts over a leading batch axis of its parameters,
+        so that evaluate_batch() can evaluate a batch of parameter sets in a single call of the function.
+
+        vectorised : bool
+        True if the model function broadcasts its parameters as arrays against its other arguments,
+        and every precomputation it makes from parameter values does the same.
+        """
+        self._vectorised = vectorised
+
+
+    def is_vectorised(self):
+        """
+        Returns True if the model function broadcasts over a batch of parameter sets.
+        """
+        return self._vectorised
+
+
+    def evaluate_batch(self, params):
+        """
+        Evaluate the model for each of a batch of values of its free parameters, using the fixed arguments.
+
+        params : array_like
+        Array of shape (B, nfree), holding one value of each free parameter (in parameter order) per row.
+
+        Returns an array whose first axis indexes the batch, followed by the shape of a single call. A vectorised
+        model is evaluated in a single call, with each free parameter given as an array of shape (B, 1, ..., 1)
+        which broadcasts against the fixed arguments. Otherwise the model is called once per row.
+        """
+
+        params = np.asarray(params, dtype = float)
+        if params.ndim != 2 or params.shape[1] != len(self._free_idxs):
+            raise ValueError("Expected a batch of parameters of shape (B, {0}), got {1}.".format(len(self._free_idxs), params.shape))
+
+        if not self._vectorised:
+            return np.array([self(*row) for row in params])
+
+        ndim = max([np.ndim(value) for value in self._fixed_args.values()] + [0])
+        columns = [params[:, k].reshape((-1,) + (1,)*ndim) for k in range(params.shape[1])]
+        values = np.asarray(self(*columns))
+        return np.broadcast_to(values, (len(params),) + values.shape[1:])
+
+
     def __call__(self, *args):
         """
         Call the underlying model function using a combination of supplied and fixed arguments.
         """
 
+        # Pass the arguments to the underlying function and return the value
+        return self._func(*self._complete_args(args))
+
+
+    def _complete_args(self, args):
+        """
+        Returns a list of all argument values, combining the supplied and fixed arguments.
+        """
+
         # Check that the correct total number of arguments has been supplied
-        if len(args) + len(self._fixed_args) != self._argcount:
+        if len(args) != len(self._free_idxs):
             raise ValueError("""Unexpected number of arguments:\n
                             {0} fixed through fix_params() method and {1} provided in this call,
                             expected {2} total""".format(len(self._fixed_args), len(args), self._argcount))
-        
-        indices = list(range(self._argcount))
-        complete_args = [np.inf]*self._argcount
 
-        # Compile a list of all argument values
-        for parname in self._fixed_args:
-            idx = self._args.index(parname)
-            indices.remove(idx)
-            complete_args[idx] = self._fixed_args[parname]
+        # Fill the free arguments into a copy of the template of fixed arguments
+        complete_args = self._template.copy()
+        for idx, arg in zip(self._free_idxs, args):
+            complete_args[idx] = arg
 
-        for idx, arg in enumerate(args):
-            complete_args[indices[idx]] = arg
-
-        # Pass the arguments to the underlying function and return the value
-        return self._func(*complete_args)
+        return complete_args
 
 
     def get_param_names(self):
@@ -259,16 +1159,95 @@ class Model():
         return self._bounds.copy()
 
 
+def _unique_widths(m, s):
+    """
+    Returns the distinct pairs of mean and width among the broadcast values of m and s, as two arrays,
+    together with the indices which rebuild the broadcast values from them.
+    """
+    m, s = np.broadcast_arrays(m, s)
+    pairs, inverse = np.unique(np.stack((np.ravel(m), np.ravel(s))), axis = 1, return_inverse = True)
+    return pairs[0], pairs[1], np.reshape(inverse, m.shape)
+
+
+@memoize(maxsize = 256)
+def _gaussian_norm(m, s, nbins):
+    """
+    Normalisation of a Gaussian of mean m and width s over the integer bins 0..nbins-1.
+    Array values of m and s give an array of normalisations of their broadcast shape.
+    """
+    bins = np.arange(int(nbins))
+    if np.ndim(m) or np.ndim(s):
+        #Normalise each distinct Gaussian once, across the bins on a trailing axis
+        m, s, inverse = _unique_widths(m, s)
+        return np.sum(np.exp(-0.5*(((bins - m[:, None])/s[:, None])**2)), axis = 1)[inverse]
+    return np.sum(np.exp(-0.5*(((bins - m)/s)**2)))
+
+
+@memoize(maxsize = 256)
+def _gaussian_norm_derivatives(m, s, nbins):
+    """
+    Derivatives of the log of the normalisation of a Gaussian over the integer bins 0..nbins-1,
+    with respect to its mean m and width s. Array values of m and s broadcast as for _gaussian_norm.
+    """
+    bins = np.arange(int(nbins))
+
+    def derivatives(m, s):
+        g = np.exp(-0.5*((bins - m)/s)**2)
+        norm = np.sum(g, axis = -1, keepdims = True)
+        return np.sum(g*(bins - m), axis = -1, keepdims = True)/(s**2*norm), np.sum(g*(bins - m)**2, axis = -1, keepdims = True)/(s**3*norm)
+
+    if np.ndim(m) or np.ndim(s):
+        #Differentiate each distinct Gaussian once, across the bins on a trailing axis
+        m, s, inverse = _unique_widths(m, s)
+        dm_norm, ds_norm = derivatives(m[:, None], s[:, None])
+        return dm_norm[:, 0][inverse], ds_norm[:, 0][inverse]
+
+    dm_norm, ds_norm = derivatives(m, s)
+    return dm_norm[0], ds_norm[0]
+
+
 @Model
 def default_model(x, p = 0.5, q = 0.3, m0 = 803, m1 = 745, s0 = 15., s1 = 15, nbins = 1000):
     
-    bins = np.arange(int(nbins))
     uniform = 1/nbins
-    early = np.exp(-0.5*((x-m1)/s1)**2.)/np.sum(np.exp(-0.5*(((bins - m1)/s1)**2)))
-    late = np.exp(-0.5*((x-m0)/s0)**2.)/np.sum(np.exp(-0.5*(((bins - m0)/s0)**2)))
+    early = np.exp(-0.5*((x-m1)/s1)**2.)/_gaussian_norm(m1, s1, nbins)
+    late = np.exp(-0.5*((x-m0)/s0)**2.)/_gaussian_norm(m0, s0, nbins)
     prob = np.abs(q)*uniform + np.abs(1-q)*(np.abs(p)*early + np.abs(1-p)*late)
     return prob
 
+def _default_model_gradient(x, p = 0.5, q = 0.3, m0 = 803, m1 = 745, s0 = 15., s1 = 15, nbins = 1000):
+    """
+    Partial derivatives of the log of default_model with respect to each of its parameters
+    """
+
+    #One-sided derivative of abs at zero, so that the gradient is correct on the parameter bounds
+    sgn = lambda v : np.where(v < 0, -1., 1.)
+
+    uniform = 1/nbins
+
+    #Each normalised Gaussian, and the derivatives of its log with respect to its mean and width
+    def gaussian(m, s):
+        dm_norm, ds_norm = _gaussian_norm_derivatives(m, s, nbins)
+        value = np.exp(-0.5*((x-m)/s)**2.)/_gaussian_norm(m, s, nbins)
+        return value, (x-m)/s**2 - dm_norm, (x-m)**2/s**3 - ds_norm
+
+    early, dm1, ds1 = gaussian(m1, s1)
+    late, dm0, ds0 = gaussian(m0, s0)
+    mixture = np.abs(p)*early + np.abs(1-p)*late
+    prob = np.abs(q)*uniform + np.abs(1-q)*mixture
+
+    return {
+        'p' : np.abs(1-q)*(sgn(p)*early - sgn(1-p)*late)/prob,
+        'q' : (sgn(q)*uniform - sgn(1-q)*mixture)/prob,
+        'm0' : np.abs(1-q)*np.abs(1-p)*late*dm0/prob,
+        'm1' : np.abs(1-q)*np.abs(p)*early*dm1/prob,
+        's0' : np.abs(1-q)*np.abs(1-p)*late*ds0/prob,
+        's1' : np.abs(1-q)*np.abs(p)*early*ds1/prob
+        }
+
+default_model.set_gradient(_default_model_gradient)
+default_model.set_vectorised()
+
 default_model.set_bounds(
     p = (0, 1),
     q = (0, 1),
@@ -281,41 +1260,210 @@ default_model.set_bounds(
 default_model.fix_params(nbins = 1000)
 
 
-def default_process(filename, p=0.5, q=0.5, m0=795., m1=739., s0=10., s1=20., verbose = True):
-    
-    mle = MaximumLikelihoodEstimator(default_model)
-    
-    data = h5.File(filename, 'r', swmr = True)
-    scope = data['osc_0'].value
-    indy_var = np.array([d[0] for d in data['analysis']])
-    data.close()
-    
-    digitised = {v:[] for v in indy_var}
-    all_hits = []
-    
-    if verbose:
-        counttracker = np.zeros(len(scope))
-        trace_dist = np.zeros(len(scope[0]))
-        timebins = np.arange(len(scope[0]))
-    
-    for k, trace in enumerate(scope):
-        edges = locate_edges(trace).tolist()
-        digitised[indy_var[k]] += edges
-        all_hits += edges
-        if verbose:
-            counttracker[k] = len(edges)
-            trace_dist[edges] += 1
-
-    mle.set_data(np.array(all_hits).reshape(1, -1))
-
-    popt, pcov = mle.estimate(
-        p = p,
-        q = q,
-        m0 = m0,
-        m1 = m1,
-        s0 = s0,
-        s1 = s1
-    )
+def _fit_point(args):
+    """Fit p of default_model to the hits of a single scan point, for use in worker processes"""
+    hits, fixes, p0 = args
+    default_model.fix_params(**fixes)
+    mle = MaximumLikelihoodEstimator(default_model, binned = True)
+    mle.set_data(hits)
+    return mle.estimate(p = p0)
+
+
+def _map_points(function, tasks, workers = None, executor = None):
+    """
+    Returns the results of function for each of tasks, computed by executor if one is given, otherwise in a pool
+    of workers processes created for this call, or serially in this process if workers is None or 1.
+    """
+    if executor is None and (workers is None or workers <= 1 or len(tasks) <= 1):
+        return [function(task) for task in tasks]
+
+    chunksize = max(1, len(tasks)//(4*max(1, workers or 1)))
+    if executor is not None:
+        return list(executor.map(function, tasks, chunksize = chunksize))
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        return list(executor.map(function, tasks, chunksize = chunksize))
+
+
+def fit_points(datasets, p0 = 0, workers = None, hook = None, tags = None, executor = None):
+    """
+    Fit p of default_model independently to each of the given datasets, with every other
+    parameter held at the value it is currently fixed at. Returns a list of FitResults, which
+    unpack as (popt, pcov), in the same order as datasets.
+
+    p0 : float or sequence of float
+    Initial estimate of p, either shared by all datasets or given for each dataset.
+
+    workers : int or None
+    Number of worker processes to fit with. If None or 1, the fits are performed serially
+    in this process.
+
+    executor : concurrent.futures.Executor or None
+    An executor to fit with instead, such as a ProcessPoolExecutor shared between calls.
+
+    hook : callable or None
+    Passed the FitResult of each fit, in this process, once all fits are complete.
+
+    tags : sequence or None
+    A tag identifying the fit to each dataset, assigned to its FitResult.
+    """
+    fixes = default_model.get_fixed_params()
+    p0 = np.broadcast_to(p0, (len(datasets),))
+    tasks = [(hits, fixes, start) for hits, start in zip(datasets, p0)]
+    results = _map_points(_fit_point, tasks, workers = workers, executor = executor)
+
+    for idx, result in enumerate(results):
+        if tags is not None:
+            result.tag = tags[idx]
+        if hook is not None:
+            hook(result)
+
+    return results
+
+
+def _bootstrap_point(args):
+    """Bootstrap p of default_model at a single scan point, for use in worker processes"""
+    hits, fixes, grid, n_resamples, seed = args
+    default_model.fix_params(**fixes)
+    mle = MaximumLikelihoodEstimator(default_model, binned = True)
+    mle.set_data(hits)
+    estimate, replicas = mle.bootstrap('p', grid, n_resamples = n_resamples, rng = seed)
+    return estimate, np.std(replicas)
+
+
+def bootstrap_points(datasets, n_resamples = 200, grid = 201, workers = None, seed = None, executor = None):
+    """
+    Estimate p of default_model and its bootstrap uncertainty independently for each of the given datasets,
+    with every other parameter held at the value it is currently fixed at. p is estimated on a grid of grid
+    values spanning its bounds, refined between grid values, and its uncertainty is the standard deviation of
+    the estimates from n_resamples resamples of the hits. Returns arrays of p and sigma, in the same order as
+    datasets.
+
+    workers : int or None
+    Number of worker processes to use. If None or 1, every point is handled serially in this process.
+
+    executor : concurrent.futures.Executor or None
+    An executor to use instead, such as a ProcessPoolExecutor shared between calls.
+
+    seed : int or None
+    Seed from which the resamples for every dataset are drawn.
+    """
+    fixes = default_model.get_fixed_params()
+    grid = np.linspace(*default_model.get_param_bounds()['p'], grid)
+    seeds = np.random.SeedSequence(seed).spawn(len(datasets))
+    tasks = [(hits, fixes, grid, n_resamples, point_seed) for hits, point_seed in zip(datasets, seeds)]
+    results = _map_points(_bootstrap_point, tasks, workers = workers, executor = executor)
+
+    p, sigma = np.array(results).reshape((-1, 2)).T
+    return p, sigma
+
+
+def refit_outliers(datasets, p, sigma, z = 1, n_starts = 5, grid = 101, max_rounds = 1000, timeout = None, workers = None,
+                   hook = None, tags = None, executor = None):
+    """
+    Refit p of default_model at the scan points whose uncertainty is an outlier, identified by z-score,
+    or is not finite. p and sigma hold the existing fits to each of the datasets, and are updated in place
+    and returned. The FitResult of every refit is passed to hook, tagged by the corresponding entry of tags.
+
+    Each round finds the outliers once and refits each of them from its next untried starting value.
+    Starting values are the n_starts best local maxima of the likelihood on a grid of p values, skipping
+    any within a grid step of the current fit, which would only converge back to it. A refit is kept only
+    if it brings sigma closer to the mean over all points. Refitting stops once every outlier has been refit
+    from each of its starting values, max_rounds rounds have been completed, or more than timeout seconds
+    have elapsed.
+
+    Refits are made by executor if one is given, otherwise in a pool of workers processes shared by every round.
+    """
+    if executor is None and workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            return refit_outliers(datasets, p, sigma, z = z, n_starts = n_starts, grid = grid, max_rounds = max_rounds,
+                                  timeout = timeout, workers = workers, hook = hook, tags = tags, executor = executor)
+
+    started = time.monotonic()
+    mle = MaximumLikelihoodEstimator(default_model, binned = True)
+    grid = np.linspace(0, 1, grid)
+    step = grid[1] - grid[0]
+    seeds = {}
+
+    for _ in range(max_rounds):
+        finite = np.flatnonzero(np.isfinite(sigma))
+        outliers = np.union1d(np.flatnonzero(~np.isfinite(sigma)), finite[locate_outliers(sigma[finite], z)[0]])
+
+        #Rank the starting values of any new outliers from a grid of the likelihood
+        for idx in outliers:
+            if idx not in seeds:
+                mle.set_data(datasets[idx])
+                loglike = mle.profile('p', grid)
+                padded = np.pad(loglike, 1, constant_values = -np.inf)
+                peaks = (loglike >= padded[:-2]) & (loglike >= padded[2:])
+                ranked = np.lexsort((-loglike, ~peaks))
+                seeds[idx] = list(grid[ranked[:n_starts]])
+
+            #A start at the current fit would only repeat it, allowing for rounding of the grid
+            seeds[idx] = [seed for seed in seeds[idx] if not abs(seed - p[idx]) < 1.5*step]
+
+        pending = [idx for idx in outliers if seeds[idx]]
+        if not pending:
+            break
+
+        refits = fit_points([datasets[idx] for idx in pending], p0 = [seeds[idx].pop(0) for idx in pending], workers = workers,
+                            hook = hook, tags = None if tags is None else [tags[idx] for idx in pending], executor = executor)
+
+        mu = np.mean(sigma[finite])
+        for idx, (xpopt, xpcov) in zip(pending, refits):
+            new_sigma = np.sqrt(xpcov[0,0])
+            if np.isfinite(new_sigma) and (not np.isfinite(sigma[idx]) or abs(new_sigma - mu) < abs(sigma[idx] - mu)):
+                p[idx] = xpopt[0]
+                sigma[idx] = new_sigma
+
+        if timeout is not None and time.monotonic() - started > timeout:
+            break
+
+    return p, sigma
+
+
+def _add_hits(hit_store, scope, indy_var, chunk_bytes, val_threshold, grd_threshold, start = 0, stop = None, writer = None,
+              verbose = False):
+    """
+    Locate the edges in the rows scope[start:stop] of a scope dataset and add them to hit_store, where indy_var
+    holds the independent variable from row start onwards. The hits are also passed to writer, if given, until
+    writing them fails, when the writer is closed incomplete and the analysis carries on without it. Returns
+    the writer, or None if it failed.
+    """
+
+    #Stream the scope traces through the edge detector a bounded block at a time
+    for block_start, block in iter_chunks(scope, max_bytes = chunk_bytes, start = start, stop = stop):
+        edgelocs, offsets = locate_edges_batch(block, val_threshold, grd_threshold)
+        hit_store.add(edgelocs, offsets, indy_var[block_start - start:block_start - start + len(block)])
+        if writer is not None:
+            try:
+                writer.add(edgelocs, offsets)
+            except OSError as e:
+                writer.close(complete = False)
+                writer = None
+                if verbose:
+                    print("Unable to write a hit index for", scope.file.filename, ":", e)
+    return writer
+
+
+def _fit_scan(hit_store, start, p0 = 0, workers = None, refit_rounds = 1000, refit_timeout = None, verbose = True, hook = None,
+              uncertainty = 'hessian', n_resamples = 200):
+    """
+    Fit default_model to every hit in hit_store from the starting values in the dictionary start, then fit p
+    at each scan point from p0 with the other parameters fixed at their global estimates. Outliers are refit if
+    uncertainty is 'hessian', while if it is 'bootstrap' the uncertainties are found by bootstrap resampling.
+    Returns the global estimates and their covariance, with p and its uncertainty sigma at each point.
+    """
+    if uncertainty not in ('hessian', 'bootstrap'):
+        raise ValueError("Unknown uncertainty {0}: expected 'hessian' or 'bootstrap'".format(uncertainty))
+
+    mle = MaximumLikelihoodEstimator(default_model, binned = True)
+    mle.set_data(hit_store.get_hits())
+
+    result = mle.estimate(**start)
+    result.tag = 'global'
+    if hook is not None:
+        hook(result)
+    popt, pcov = result
     
     newfixes = {'q':popt[1],'m0':popt[2], 'm1':popt[3], 's0':popt[4], 's1':popt[5]}
     pnames = default_model.get_param_names()
@@ -323,26 +1471,183 @@ def default_process(filename, p=0.5, q=0.5, m0=795., m1=739., s0=10., s1=20., ve
     if verbose:
         for k, val in enumerate(popt):
             print(pnames[k+1]+":\t",val,"\t+/-\t",np.sqrt(pcov[k, k]))
-        print("Based on",np.size(all_hits),"data points \n")
+        print("Based on",np.size(hit_store.get_hits()),"data points \n")
 
     default_model.fix_params(**newfixes)
     
-    x = np.sort([v for v in digitised])
+    x = hit_store.get_points()
+    datasets = [hit_store[idx] for idx in range(len(x))]
     p = np.zeros_like(x)
     sigma = np.zeros_like(x)
     
-    for idx, point in enumerate(x):
-        mle.set_data(np.array(digitised[point]))
-        xpopt, xpcov = mle.estimate(p=0)
-        p[idx] = xpopt[0]
-        sigma[idx] = np.sqrt(xpcov[0,0])
+    #A single pool of workers serves every stage of fitting the points
+    pool = ProcessPoolExecutor(max_workers = workers) if workers is not None and workers > 1 else nullcontext()
+    with pool as executor:
+        point_fits = fit_points(datasets, p0 = p0, workers = workers, hook = hook, tags = [('fit', point) for point in x],
+                                executor = executor)
+        for idx, (xpopt, xpcov) in enumerate(point_fits):
+            p[idx] = xpopt[0]
+            sigma[idx] = np.sqrt(xpcov[0,0])
+
+        if uncertainty == 'bootstrap':
+            #Fall back on the bootstrap estimate wherever the fit failed
+            p_boot, sigma = bootstrap_points(datasets, n_resamples = n_resamples, workers = workers, executor = executor)
+            p = np.where(np.isfinite(p), p, p_boot)
+        else:
+            refit_outliers(datasets, p, sigma, max_rounds = refit_rounds, timeout = refit_timeout, workers = workers,
+                           hook = hook, tags = [('refit', point) for point in x], executor = executor)
+    return popt, pcov, p, sigma
+
+
+def default_process(filename, p=0.5, q=0.5, m0=795., m1=739., s0=10., s1=20., verbose = True, chunk_bytes = 2**26, workers = None,
+                    refit_rounds = 1000, refit_timeout = None, joint = False,
+                    val_threshold = 0.0005, grd_threshold = -0.0001, use_index = True, full_output = False, hook = None,
+                    uncertainty = 'hessian', n_resamples = 200):
+    """
+    Fit default_model to the scan in filename, returning the scan points x together with the
+    fitted value of p and its uncertainty sigma at each point. The osc_0 dataset is streamed
+    through the edge detector in blocks of at most chunk_bytes bytes of traces, and the fits
+    at each scan point are spread over the given number of worker processes. Points with outlying
+    uncertainties are refit for at most refit_rounds rounds or refit_timeout seconds.
+
+    If uncertainty is 'bootstrap', sigma is instead the spread of p over n_resamples bootstrap
+    resamples of the hits at each point, and no refitting is done.
+
+    Edges are located with the given thresholds. If use_index is True, the hits found are kept in a
+    sidecar index next to filename, and reused while the file and thresholds are unchanged.
+
+    If joint is True, the shared parameters and p at every point are instead fit together in a
+    single optimisation, giving a consistent covariance across points, and no refitting is done.
+
+    If full_output is True, a dictionary describing the fit is also returned, holding the names,
+    estimates and covariance of the parameters fit globally, the number of hits and the time taken.
+
+    If a hook is given, such as a FitRecorder, it is passed the FitResult of every fit, tagged with
+    'global' or 'joint', or with ('fit', point) and ('refit', point) for the fits at each scan point.
+    """
+    started = time.monotonic()
     
-    for k in range(1000):
-        for idx, point in enumerate(x):
-            if idx in locate_outliers(sigma)[0]:
-                mle.set_data(np.array(digitised[point]))
-                xpopt, xpcov = mle.estimate(p=np.random.uniform())
-                p[idx] = xpopt[0]
-                sigma[idx] = np.sqrt(xpcov[0,0])
-                
-    return x, p, sigma
\ No newline at end of file
+    hit_store = HitStore()
+    with h5.File(filename, 'r', swmr = True) as data:
+        indy_var = scan_column(data['analysis'])
+        scope = data['osc_0']
+
+        key = hit_index_key(filename, scope.shape, val_threshold, grd_threshold)
+        index = load_hit_index(filename, key) if use_index else None
+
+        if index is not None:
+            hit_store.add(*index, indy_var[:scope.shape[0]])
+
+        else:
+            writer = None
+            if use_index:
+                try:
+                    writer = HitIndexWriter(filename, key)
+                except OSError as e:
+                    if verbose:
+                        print("Unable to write a hit index for", filename, ":", e)
+
+            try:
+                writer = _add_hits(hit_store, scope, indy_var, chunk_bytes, val_threshold, grd_threshold, writer = writer,
+                                   verbose = verbose)
+            except BaseException:
+                if writer is not None:
+                    writer.close(complete = False)
+                raise
+
+            if writer is not None:
+                try:
+                    writer.close()
+                except OSError as e:
+                    if verbose:
+                        print("Unable to write a hit index for", filename, ":", e)
+
+    x = hit_store.get_points()
+
+    if joint:
+        #Fit the shared parameters and p at every point together, in a single optimisation
+        mle = MaximumLikelihoodEstimator(default_model, binned = True)
+        mle.set_data(hit_store.get_hits())
+        result = mle.estimate_joint(hit_store.get_offsets(), p = p, q = q, m0 = m0, m1 = m1, s0 = s0, s1 = s1)
+        result.tag = 'joint'
+        if hook is not None:
+            hook(result)
+        popt, pcov = result
+        pnames = default_model.get_param_names()
+
+        if verbose:
+            for k, val in enumerate(popt[:5]):
+                print(pnames[k+2]+":\t",val,"\t+/-\t",np.sqrt(pcov[k, k]))
+            print("Based on",np.size(hit_store.get_hits()),"data points \n")
+
+        default_model.fix_params(**dict(zip(pnames[2:7], popt[:5])))
+        names, popt, pcov, p, sigma = pnames[2:7], popt[:5], pcov[:5, :5], popt[5:], np.sqrt(np.diag(pcov)[5:])
+
+    else:
+        popt, pcov, p, sigma = _fit_scan(hit_store, dict(p = p, q = q, m0 = m0, m1 = m1, s0 = s0, s1 = s1),
+                                         workers = workers, refit_rounds = refit_rounds, refit_timeout = refit_timeout,
+                                         verbose = verbose, hook = hook, uncertainty = uncertainty, n_resamples = n_resamples)
+        names = default_model.get_param_names()[1:7]
+
+    if full_output:
+        info = {
+            'names' : names,
+            'popt' : np.asarray(popt),
+            'pcov' : np.asarray(pcov),
+            'nhits' : np.size(hit_store.get_hits()),
+            'elapsed' : time.monotonic() - started
+            }
+        return x, p, sigma, info
+
+    return x, p, sigma
+
+
+def follow_process(filename, p=0.5, q=0.5, m0=795., m1=739., s0=10., s1=20., verbose = False, chunk_bytes = 2**26,
+                   workers = None, refit_rounds = 10, refit_timeout = None, val_threshold = 0.0005, grd_threshold = -0.0001,
+                   poll_interval = 1., idle_timeout = None, hook = None, uncertainty = 'hessian', n_resamples = 200):
+    """
+    Generator following a scan file while it is still being written in SWMR mode, yielding the scan points x
+    together with the fitted value of p and its uncertainty sigma at each point whenever new traces arrive.
+
+    Only the new rows of osc_0 and analysis are read and passed through the edge detector on each update, and
+    each fit is started from the estimates of the previous update. The file is checked for new rows every
+    poll_interval seconds, and following stops once no new rows have arrived for idle_timeout seconds (if given).
+    The remaining arguments are as for default_process.
+    """
+
+    hit_store = HitStore()
+    start = dict(p = p, q = q, m0 = m0, m1 = m1, s0 = s0, s1 = s1)
+    previous = {}
+    processed = 0
+    last_update = time.monotonic()
+
+    with h5.File(filename, 'r', swmr = True) as data:
+        scope = data['osc_0']
+        analysis = data['analysis']
+
+        while True:
+            scope.refresh()
+            analysis.refresh()
+            available = min(scope.shape[0], analysis.shape[0])
+
+            if available <= processed:
+                if idle_timeout is not None and time.monotonic() - last_update > idle_timeout:
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            indy_var = scan_column(analysis, start = processed, stop = available)
+            _add_hits(hit_store, scope, indy_var, chunk_bytes, val_threshold, grd_threshold, start = processed, stop = available)
+            processed = available
+            last_update = time.monotonic()
+
+            #Warm-start every fit from the estimates of the previous update
+            x = hit_store.get_points()
+            p0 = [previous.get(point, start['p']) for point in x]
+            popt, pcov, p, sigma = _fit_scan(hit_store, start, p0 = p0, workers = workers, refit_rounds = refit_rounds,
+                                             refit_timeout = refit_timeout, verbose = verbose, hook = hook,
+                                             uncertainty = uncertainty, n_resamples = n_resamples)
+
+            start = dict(zip(('p', 'q', 'm0', 'm1', 's0', 's1'), popt))
+            previous = dict(zip(x, p))
+            yield x, p, sigma
@@ -0,0 +1,139 @@
+"""
+Command line entry point for batch processing of scan files with default_process.
+
+Usage:
+    python -m cassie [options] FILE_OR_GLOB [FILE_OR_GLOB ...]
+
+Each scan file is processed in its own worker process, and the results are written to a single
+HDF5 file holding one group per scan, named after the scan file (with its directory, where scan files in
+different directories share a name), with the datasets x, p and sigma
+and the global fit estimates popt and covariance pcov. The options of the fit are stored as
+attributes of each group, so that groups written by earlier runs into the same file keep their own.
+"""
+import os
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import h5py as h5
+
+from .cassie import default_process
+
+
+def expand_paths(patterns):
+    """
+    Returns the sorted, unique paths matching the given file names or glob patterns.
+    """
+    paths = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+        if not matches and os.path.isfile(pattern):
+            matches = [pattern]
+        paths.update(os.path.abspath(match) for match in matches)
+    return sorted(paths)
+
+
+def group_names(filenames):
+    """
+    Returns the name of the output group of each of the given scan files: its base name without extension or,
+    where several files share that, its path relative to their common directory, with directory separators
+    replaced by underscores. Raises ValueError if the names are still not unique.
+    """
+    stems = [os.path.splitext(os.path.basename(filename))[0] for filename in filenames]
+    names = []
+    for filename, stem in zip(filenames, stems):
+        shared = [other for other, other_stem in zip(filenames, stems) if other_stem == stem]
+        if len(shared) > 1:
+            stem = os.path.relpath(os.path.splitext(filename)[0], os.path.commonpath(shared)).replace(os.sep, '_')
+        names.append(stem)
+
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError("Scan files would share the output groups " + ", ".join(duplicates))
+    return names
+
+
+def _process(filename, options):
+    """Run default_process on a single file, for use in worker processes"""
+    return default_process(filename, verbose = False, full_output = True, **options)
+
+
+def _write_result(out, name, filename, result, options):
+    """Write the result of processing filename with options into its own group of the output file, called name"""
+    if name in out:
+        del out[name]
+    group = out.create_group(name)
+    x, p, sigma, info = result
+
+    group.attrs['source'] = filename
+    group.attrs['names'] = info['names']
+    group.attrs['nhits'] = info['nhits']
+    group.attrs['elapsed'] = info['elapsed']
+    for key, value in options.items():
+        group.attrs[key] = "None" if value is None else value
+    group.create_dataset('x', data = x)
+    group.create_dataset('p', data = p)
+    group.create_dataset('sigma', data = sigma)
+    group.create_dataset('popt', data = info['popt'])
+    group.create_dataset('pcov', data = info['pcov'])
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m cassie", description = "Batch process scan files with cassie.default_process.")
+    parser.add_argument("files", nargs = "+", help = "scan files, or glob patterns matching scan files")
+    parser.add_argument("-o", "--output", default = "cassie_results.h5", help = "consolidated output file (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type = int, default = os.cpu_count(), help = "number of worker processes (default: %(default)s)")
+
+    fit = parser.add_argument_group("fit options")
+    for name, default in (("p", 0.5), ("q", 0.5), ("m0", 795.), ("m1", 739.), ("s0", 10.), ("s1", 20.)):
+        fit.add_argument("--" + name, type = float, default = default, help = "initial estimate of " + name + " (default: %(default)s)")
+    fit.add_argument("--joint", action = "store_true", help = "fit all scan points jointly")
+    fit.add_argument("--refit-rounds", type = int, default = 1000, help = "maximum number of outlier refit rounds (default: %(default)s)")
+    fit.add_argument("--refit-timeout", type = float, default = None, help = "time limit for outlier refitting, in seconds")
+    fit.add_argument("--uncertainty", choices = ("hessian", "bootstrap"), default = "hessian",
+                     help = "how the uncertainty of p at each point is found (default: %(default)s)")
+    fit.add_argument("--resamples", dest = "n_resamples", type = int, default = 200,
+                     help = "number of bootstrap resamples at each point (default: %(default)s)")
+    fit.add_argument("--val-threshold", type = float, default = 0.0005, help = "edge detection value threshold (default: %(default)s)")
+    fit.add_argument("--grd-threshold", type = float, default = -0.0001, help = "edge detection gradient threshold (default: %(default)s)")
+    fit.add_argument("--chunk-bytes", type = int, default = 2**26, help = "maximum bytes of traces read at once (default: %(default)s)")
+    fit.add_argument("--no-index", dest = "use_index", action = "store_false", help = "do not read or write sidecar hit indices")
+
+    return parser.parse_args(argv)
+
+
+def main(argv = None):
+    """
+    Process every scan file given on the command line, returning a non-zero exit status if any failed.
+    """
+    args = parse_args(argv)
+    filenames = expand_paths(args.files)
+    if not filenames:
+        print("No scan files matched", " ".join(args.files), file = sys.stderr)
+        return 1
+
+    try:
+        names = dict(zip(filenames, group_names(filenames)))
+    except ValueError as e:
+        print(e, file = sys.stderr)
+        return 1
+
+    options = {name : getattr(args, name) for name in (
+        "p", "q", "m0", "m1", "s0", "s1", "joint", "refit_rounds", "refit_timeout", "uncertainty", "n_resamples",
+        "val_threshold", "grd_threshold", "chunk_bytes", "use_index")}
+
+    failures = 0
+    with h5.File(args.output, 'a') as out:
+        with ProcessPoolExecutor(max_workers = max(1, min(args.workers, len(filenames)))) as executor:
+            futures = {executor.submit(_process, filename, options) : filename for filename in filenames}
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    _write_result(out, names[filename], filename, future.result(), options)
+                    print("Processed", filename)
+                except Exception as e:
+                    failures += 1
+                    print("Failed to process", filename, ":", e, file = sys.stderr)
+
+    return 1 if failures else 0
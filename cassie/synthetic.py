@@ -0,0 +1,70 @@
+import numpy as np
+import h5py as h5
+
+from .cassie import default_model
+
+
+def sample_hits(n, p = 0.5, q = 0.3, m0 = 803, m1 = 745, s0 = 15., s1 = 15, nbins = 1000, rng = None):
+    """
+    Returns n hit times drawn from default_model with the given parameters, as integer time bins.
+    """
+    rng = np.random.default_rng(rng)
+    bins = np.arange(int(nbins))
+    prob = default_model.__wrapped__(bins, p, q, m0, m1, s0, s1, nbins)
+    return rng.choice(bins, size = n, p = prob/np.sum(prob))
+
+
+def generate_scan(filename, points = np.linspace(0, 1, 21), shots = 100, samples = 1000, hit_rate = 3.,
+                  p = lambda x : 0.5 + 0.4*np.cos(2*np.pi*x), q = 0.74, m0 = 795., m1 = 736., s0 = 17., s1 = 11.,
+                  noise = 0.0001, pulse = (0.002, 0.004, 0.006, 0.004, 0.002), chunk_shots = 256, seed = None):
+    """
+    Write a synthetic scan file in the layout read by default_process, and return the value of p at each point.
+
+    The osc_0 dataset holds one scope trace of the given number of samples per shot, with Gaussian baseline
+    noise and a falling-edge pulse at each hit. The number of hits in each shot is Poisson distributed with
+    mean hit_rate, and their times are drawn from default_model. The first column of the analysis dataset
+    holds the scan point of each shot, with the given number of shots taken at each point in turn.
+
+    p : callable or sequence
+    Either a function giving the value of p at a scan point, or the value of p at each point.
+
+    chunk_shots : int
+    The number of shots in each chunk of osc_0, which is also the number generated at once.
+    """
+    rng = np.random.default_rng(seed)
+    points = np.asarray(points, dtype = float)
+    p = np.asarray(p(points) if callable(p) else p, dtype = float)
+    pulse = np.asarray(pulse)
+
+    indy_var = np.repeat(points, shots)
+    nshots = len(indy_var)
+
+    with h5.File(filename, 'w', libver = 'latest') as f:
+        scope = f.create_dataset('osc_0', shape = (nshots, samples), dtype = np.float32,
+                                 chunks = (min(chunk_shots, max(nshots, 1)), samples))
+        analysis = np.zeros((nshots, 2))
+        analysis[:, 0] = indy_var
+        analysis[:, 1] = np.arange(nshots)
+        f.create_dataset('analysis', data = analysis)
+
+        for start in range(0, nshots, chunk_shots):
+            stop = min(start + chunk_shots, nshots)
+            traces = rng.normal(0, noise, (stop - start, samples))
+
+            #Draw the hits of each shot in this chunk from default_model, at that shot's value of p
+            counts = rng.poisson(hit_rate, stop - start)
+            shot = np.repeat(np.arange(stop - start), counts)
+            times = np.empty(len(shot), dtype = int)
+            shot_p = np.repeat(p, shots)[start:stop]
+            for value in np.unique(shot_p):
+                at_value = shot_p[shot] == value
+                times[at_value] = sample_hits(np.count_nonzero(at_value), value, q, m0, m1, s0, s1, samples, rng)
+
+            #Place a falling-edge pulse at each hit, keeping it clear of the ends of the trace
+            times = np.clip(times, 3, samples - len(pulse) - 1)
+            for k, depth in enumerate(pulse):
+                np.subtract.at(traces, (shot, times + k), depth)
+
+            scope[start:stop] = traces
+
+    return p
@@ -1,9 +1,234 @@
+from time import time
+
+import numpy as np
+from utils import app_config
+from pages.page_system_messages import log
+
+
+def envelope(y, bins):
+    """Returns the sorted indices of the minimum and maximum of y within each
+    of bins equal runs of samples, which trace the outline of y when plotted
+    over bins pixels. If y has no more than 2*bins samples, all are kept."""
+
+    n = len(y)
+    if n <= 2*bins:
+        return np.arange(n)
+
+    run = -(-n//bins)
+    padded = np.full(bins*run, np.nan)
+    padded[:n] = y
+    padded = padded.reshape((bins, run))
+
+    offsets = run*np.arange(bins)
+    lo = np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1) + offsets
+    hi = np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1) + offsets
+    idx = np.unique(np.concatenate((lo, hi)))
+    return idx[idx < n]
+
+
+def column_dtype(dtype, column):
+    # The dtype of a column, from a single dtype or a dictionary of dtypes by column
+    return dtype.get(column) if isinstance(dtype, dict) else dtype
+
+
+def transport(values, dtype=None):
+    """Returns values as a contiguous, native byte order array of dtype (by
+    default, its own), copying only if necessary, so that Bokeh sends it to
+    the browser as a binary buffer rather than as a list."""
+
+    values = np.asarray(values)
+    if dtype is None or not np.can_cast(values.dtype, dtype, "same_kind"):
+        dtype = values.dtype.newbyteorder("=")
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+class RingBuffer:
+    """A fixed-size store of the most recent samples of a measurement, with
+    the time each sample was taken. Memory for the times and for each column
+    is allocated once, when the first samples of it arrive, and old samples are
+    overwritten once the buffer is full."""
+
+    def __init__(self, depth, dtype=None) -> None:
+        self.depth = int(depth)  # The number of samples retained
+        self.dtype = dtype  # The dtype of the stored columns, or a dictionary of dtypes by column,
+        # or None to keep that of the data (which is also kept where converting would change its
+        # kind, such as complex to real)
+        self.head = 0  # The total number of samples ever written
+        self.last = 0  # The number of samples written by the latest append of any
+
+        self.times = None
+        self.columns = {}
+
+    def append(self, columns, timestamp=None):
+        """Store equal-length arrays of samples, keyed by column name, all
+        taken at timestamp (by default, now)."""
+
+        columns = {k: np.ravel(v) for k, v in columns.items()}
+        lengths = {len(v) for v in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("Columns of unequal length " + str(lengths))
+        n = lengths.pop() if lengths else 0
+
+        # Allocate each column the first time it is seen
+        if self.times is None:
+            self.times = np.zeros(self.depth)
+        for k, v in columns.items():
+            if k not in self.columns:
+                dtype = column_dtype(self.dtype, k)
+                if dtype is None or not np.can_cast(v.dtype, dtype, "same_kind"):
+                    dtype = v.dtype
+                self.columns[k] = np.zeros(self.depth, dtype=dtype)
+
+        # Only the last depth samples of a long append can be retained
+        skip = max(0, n - self.depth)
+        start = (self.head + skip) % self.depth
+        split = min(n - skip, self.depth - start)
+
+        for store, values in [(self.times, None)] + [(self.columns[k], v) for k, v in columns.items()]:
+            if values is None:
+                values = np.full(n, time() if timestamp is None else timestamp)
+            store[start:start + split] = values[skip:skip + split]
+            store[:n - skip - split] = values[skip + split:]
+
+        self.head += n
+        if n:
+            self.last = n
+
+    def __len__(self):
+        return min(self.head, self.depth)
+
+    def unroll(self, array):
+        # The retained samples of array, oldest first
+        if self.head <= self.depth:
+            return array[:self.head]
+        start = self.head % self.depth
+        return np.concatenate((array[start:], array[:start]))
+
+    def latest(self):
+        """Returns a dictionary of the retained samples of the latest append
+        of any in each column, oldest first, as views where they are not split
+        by the end of the buffer."""
+
+        n = min(self.last, self.depth)
+        start = (self.head - n) % self.depth
+        if start + n <= self.depth:
+            return {k: v[start:start + n] for k, v in self.columns.items()}
+        return {k: np.concatenate((v[start:], v[:start + n - self.depth])) for k, v in self.columns.items()}
+
+    def read(self, start=None, stop=None):
+        """Returns the times of the retained samples taken in [start, stop),
+        and a dictionary of their values in each column, oldest first."""
+
+        if self.times is None:
+            return np.zeros(0), {}
+        times = self.unroll(self.times)
+        lo = 0 if start is None else np.searchsorted(times, start, "left")
+        hi = len(times) if stop is None else np.searchsorted(times, stop, "left")
+        return times[lo:hi], {k: self.unroll(v)[lo:hi] for k, v in self.columns.items()}
+
 
 class DataManager:
+    """A store of the measurements made by the monitors of every instrument,
+    holding a bounded history of each in a RingBuffer and feeding the latest
+    values of each to the ColumnDataSource that displays it."""
 
     def __init__(self) -> None:
-        pass
+        self.buffers = {}
+        self.sources = {}
+        self.widths = {}  # The width in pixels each measurement is shown at
+        self.dtypes = {}  # The dtype each measurement is stored and sent as
+        self.recorders = {}  # The Recorder writing each measurement to file, if any
+        self.views = {}  # The range of x shown for each measurement
+
+    def register(self, measurement, depth=None, dtype=None, width=None):
+        """Register each element of a dictionary mapping measurement names to
+        the ColumnDataSources they are displayed in. Each measurement retains
+        its latest depth samples as dtype (by default from the app config),
+        which may be a dictionary of dtypes by column, and is sent to its
+        source as that dtype.
+        If width is given, the samples sent to a source are reduced to the
+        envelope of y at that many pixels, see set_view()."""
+
+        depth = app_config.get("monitor_depth", 2**20) if depth is None else depth
+        dtype = app_config.get("monitor_dtype", None) if dtype is None else dtype
+
+        for name, source in measurement.items():
+            self.buffers[name] = RingBuffer(depth, dtype)
+            self.sources[name] = source
+            self.widths[name] = width
+            self.dtypes[name] = dtype
+            self.views[name] = (None, None)
+
+    def append(self, name, columns, timestamp=None):
+        """Store a set of samples of a registered measurement, and replace the
+        values shown by its ColumnDataSource with them, as read back from its
+        RingBuffer. The samples are kept as typed arrays, converted to the
+        measurement's dtype."""
+
+        timestamp = time() if timestamp is None else timestamp
+        columns = {k: transport(v, column_dtype(self.dtypes[name], k)) for k, v in columns.items()}
+        self.buffers[name].append(columns, timestamp)
+
+        if name in self.recorders and "y" in columns:
+            try:
+                self.recorders[name].add(columns["y"], columns.get("x"), timestamp)
+            except RuntimeError as e:
+                self.stop_recording(name)
+                log(str(e))
+
+        datalen = len(next(iter(columns.values()))) if columns else 0
+        if datalen > 0:
+            self.render(name)
+
+    def start_recording(self, name, recorder):
+        """Pass the y values of every subsequent set of samples of a
+        measurement to a Recorder, which writes them in the background."""
+        self.stop_recording(name)
+        self.recorders[name] = recorder
+
+    def stop_recording(self, name):
+        """Stop recording a measurement, once its queued samples are written."""
+        recorder = self.recorders.pop(name, None)
+        if recorder is not None:
+            recorder.close()
+        return recorder
+
+    def set_view(self, name, start=None, stop=None):
+        """Show the range of x between start and stop of a measurement at full
+        resolution, up to the width of its plot, and redraw it."""
+
+        self.views[name] = (start, stop)
+        if self.buffers[name].last:
+            self.render(name)
+
+    def render(self, name):
+        # Send the samples of the latest append from the buffer to the
+        # source, reduced to the envelope of y at the plot's width both
+        # within and outside the range in view, so that the whole trace stays
+        # in outline when zoomed in
+        columns = self.buffers[name].latest()
+        width = self.widths[name]
+        x, y = columns.get("x"), columns.get("y")
+
+        if width is not None and x is not None and y is not None and len(x) > 2*width \
+                and np.isrealobj(y) and np.all(np.diff(x) >= 0):
+            start, stop = self.views[name]
+            inside = np.ones(len(x), dtype=bool)
+            if start is not None:
+                inside &= x >= start
+            if stop is not None:
+                inside &= x <= stop
+
+            idx = np.concatenate([
+                np.flatnonzero(mask)[envelope(y[mask], width)] for mask in (inside, ~inside)])
+            idx.sort()
+            columns = {k: v[idx] for k, v in columns.items()}
+
+        # Replace the whole trace, so that the typed arrays are sent as they
+        # are, rather than appended to (and promoted with) the previous ones
+        self.sources[name].data = columns
 
-    def register(self, measurement):
-        pass
-    pass
\ No newline at end of file
+    def read(self, name, start=None, stop=None):
+        """Returns the times and values of the retained samples of a
+        measurement taken between the times start and stop."""
+        return self.buffers[name].read(start, stop)
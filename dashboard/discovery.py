@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from instrument import Instrument
+
+
+def probe(rm, port, timeout, manager):
+    """Open a port of a VISA resource manager, identify the instrument on it
+    and load its config, giving up on a port that does not answer within
+    timeout milliseconds. Returns the Instrument and the messages of loading
+    its config, to be logged on the event loop. The port is closed again if
+    any of this fails."""
+
+    candidate = rm.open_resource(port, open_timeout=timeout)
+
+    try:
+        io_timeout, candidate.timeout = candidate.timeout, timeout
+        idn = candidate.query("*IDN?")
+
+        # Later operations, such as long sweeps, keep the usual timeout
+        candidate.timeout = io_timeout
+
+        idn = idn.replace("*", "").replace("IDN", "").replace(".", "-").strip()
+
+        # Loading the config writes the init commands, so it also stays off
+        # the event loop
+        messages = []
+        inst = Instrument(candidate, manager, *idn.split(",")[:4])
+        inst.load_config(report=messages.append)
+
+    except Exception:
+        candidate.close()
+        raise
+
+    return inst, messages
+
+
+def probe_ports(rm, timeout, manager, deliver):
+    """Probe every port of a VISA resource manager at once, so that dead ports
+    only cost a single timeout, calling deliver(port, future) as each is done,
+    where future holds the result of probe(). Returns the number of ports."""
+
+    ports = rm.list_resources()
+    if ports:
+        with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+            futures = {executor.submit(probe, rm, port, timeout, manager): port for port in ports}
+            for future in as_completed(futures):
+                deliver(futures[future], future)
+    return len(ports)
@@ -3,10 +3,13 @@ from os import path
 import json
 
 import numpy as np
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from data_manager import DataManager
 from instrument_widget import InstrumentWidget
 from pages.page_system_messages import log
 from functools import partial
+from string import Formatter
 
 
 class Instrument:
@@ -39,7 +42,16 @@ class Instrument:
 
         self.instrument_widget = None
 
-    def load_config(self):
+        # All I/O with the device happens in order on a single worker thread,
+        # so that slow round trips never block the Bokeh event loop
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.pending = 0  # The number of operations queued or running on the worker
+        self.pending_lock = Lock()
+
+    def load_config(self, report=log):
+        """Load the config file of the instrument and write its init commands
+        to the device. Problems are passed to report, which must be replaced
+        when this is not run on the document's event loop."""
 
         # The config file should be called instrument.cfg and located in a directory
         # with a name given by the manufacturer and model of the instrument, as
@@ -69,11 +81,19 @@ class Instrument:
                     if "write_termination" in config:
                         self.device.write_termination = config["write_termination"]
 
+                    # Query results are parsed straight into typed arrays,
+                    # with the binary datatype and byte order of the driver
                     if "query_type" in config:
                         if config["query_type"] == "binary":
-                            self.query = self.device.query_binary_values
+                            self.query = partial(
+                                self.device.query_binary_values,
+                                datatype=config.get("datatype", "f"),
+                                is_big_endian=config.get("is_big_endian", False),
+                                container=np.ndarray)
                         elif config["query_type"] == "ascii":
-                            self.query = self.device.query_ascii_values
+                            self.query = partial(
+                                self.device.query_ascii_values,
+                                container=np.ndarray)
 
                     if "init" in config:
                         for cmd in config["init"]:
@@ -99,70 +119,68 @@ class Instrument:
                 self.config_found = False
 
                 # And add the exception to the message buffer
-                log(str(e))
+                report(str(e))
 
             self.instrument_widget = InstrumentWidget(self)
 
         else:
-            log(dst + " was not found.")
+            report(dst + " was not found.")
 
         # Report the success state of the config load at end of method call
         return self.config_found
 
     def bind(self, command_set):
 
-        keywords = ("init", "on_change", "x", "y", "z")
-        cmd_types = ("inst", "query", "read", "write", "proc", "exec")
+        # Compile the command set once, into a flat plan of the steps to take
+        # on each call, so that a call only does I/O and numeric work
+        plan = self.compile_plan(command_set)
 
-        def method(attr, old, new):
+        def method(attr, old, new, cache=None):
 
+            # Queries found in cache are not repeated, and the results of
+            # those made are added to it, for the other monitors of a poll
             to_stream = {}
             last_query = None
 
-            for k in keywords:
-                if k in command_set:
-                    for command in command_set[k]:
-                        if (
-                            ("condition" not in command) or
-                            ("condition" in command and eval(
-                                command["condition"].format(new, old, attr)))
-                        ):
-
-                            if "inst" in command:
-                                cmdtxt = command["inst"].format(new, old, attr)
-                                if "?" in cmdtxt:
-                                    last_query = self.query(
-                                        cmdtxt, container=np.array)
-                                    to_stream.update({k: last_query})
-                                else:
-                                    self.device.write(cmdtxt)
-
-                            elif "query" in command:
-                                cmdtxt = command["query"].format(
-                                    new, old, attr
-                                )
-                                last_query = self.query(
-                                    cmdtxt, container=np.array
-                                )
-                                to_stream.update({k: last_query})
-
-                            elif "read" in command:
-                                cmdtxt = command["read"].format(new, old, attr)
-                                last_query = self.device.read_raw()
-                                to_stream.update({k: last_query})
-
-                            elif "write" in command:
-                                cmdtxt = command["write"].format(
-                                    new, old, attr)
-                                self.device.write(cmdtxt)
-
-                            elif "proc" in command:
-                                f = eval(command["proc"].format(
-                                    new, old, attr))
-                                to_stream.update({k: f(last_query)})
-
-                            elif "exec" in command:
-                                exec(command["exec"].format(new, old, attr))
+            for k, condition, kind, action in plan:
+                if condition is not None and not condition(new, old, attr):
+                    continue
+
+                if kind == "proc":
+                    to_stream.update({k: action(new, old, attr)(last_query)})
+                    continue
+
+                # Every other action gives the text of a command
+                cmdtxt = action(new, old, attr)
+
+                # Statements see the same names as they did when the command
+                # set was interpreted on each call, so they can still read
+                # the last query and add to (or change) what is streamed
+                if kind == "exec":
+                    exec(cmdtxt, globals(),
+                         {"self": self, "new": new, "old": old, "attr": attr,
+                          "k": k, "last_query": last_query,
+                          "to_stream": to_stream, "command_set": command_set})
+                    continue
+
+                if kind == "inst":
+                    kind = "query" if "?" in cmdtxt else "write"
+
+                if kind == "query":
+                    if cache is None:
+                        last_query = self.query(cmdtxt)
+                    elif cmdtxt in cache:
+                        last_query = cache[cmdtxt]
+                    else:
+                        last_query = cache[cmdtxt] = self.query(cmdtxt)
+                    to_stream.update({k: last_query})
+
+                elif kind == "read":
+                    last_query = self.device.read_raw()
+                    to_stream.update({k: last_query})
+
+                elif kind == "write":
+                    self.device.write(cmdtxt)
 
             to_stream = {k: to_stream[k]
                          for k in ("x", "y", "z") if k in to_stream}
@@ -173,5 +191,139 @@ class Instrument:
             method = partial(method, "", "", "")
         return method
 
+    def compile_plan(self, command_set):
+        """Returns the steps of a command set in execution order, as tuples of
+        (keyword, condition, kind, action). The condition is None or a callable
+        of (new, old, attr), and the action a callable of (new, old, attr)
+        returning the command text or, for "proc", the processing callable."""
+
+        keywords = ("init", "on_change", "x", "y", "z")
+        cmd_types = ("inst", "query", "read", "write", "proc", "exec")
+
+        plan = []
+        for k in keywords:
+            for command in command_set.get(k, []):
+                kind = next((t for t in cmd_types if t in command), None)
+                if kind is None:
+                    continue
+
+                condition = None
+                if "condition" in command:
+                    condition = self.compile_expression(command["condition"])
+
+                if kind == "proc":
+                    action = self.compile_expression(command["proc"], call=False)
+                elif kind == "exec":
+                    action = self.compile_statement(command["exec"])
+                else:
+                    action = self.compile_template(command[kind])
+
+                    # Commands without replacement fields are known to be
+                    # queries or writes before they are ever called
+                    if kind == "inst" and not self.template_fields(command[kind]):
+                        kind = "query" if "?" in command[kind] else "write"
+
+                plan.append((k, condition, kind, action))
+
+        return plan
+
+    @staticmethod
+    def template_fields(template):
+        return [f for f in Formatter().parse(template) if f[1] is not None]
+
+    def compile_template(self, template):
+        """Returns a callable of (new, old, attr) giving the text of a command
+        template, which skips formatting when there is nothing to format."""
+
+        if not self.template_fields(template):
+            text = template.replace("{{", "{").replace("}}", "}")
+            return lambda new, old, attr: text
+        return lambda new, old, attr: template.format(new, old, attr)
+
+    def compile_expression(self, template, call=True):
+        """Compiles an expression template, such as a condition, in which the
+        replacement fields stand for the new value, old value and attribute
+        name of a change. Plain fields become the variables new, old and attr
+        of a compiled function. Templates with format specifications are
+        instead formatted and evaluated when called. If call is False, an
+        expression without fields is evaluated only once, here."""
+
+        fields = self.template_fields(template)
+        names = ("new", "old", "attr")
+
+        if not fields and not call:
+            value = eval(template.replace("{{", "{").replace("}}", "}"))
+            return lambda new, old, attr: value
+
+        if all(field in ("", "0", "1", "2") and not spec and not conversion
+               for _, field, spec, conversion in fields):
+            source = ""
+            auto = 0
+            for literal, field, spec, conversion in Formatter().parse(template):
+                source += literal
+                if field is not None:
+                    source += "(" + names[auto if field == "" else int(field)] + ")"
+                    auto += field == ""
+            return eval("lambda new, old, attr : " + source)
+
+        return lambda new, old, attr: eval(template.format(new, old, attr))
+
+    def compile_statement(self, template):
+        """Returns a callable of (new, old, attr) giving a statement template
+        ready to exec, compiled once when it has no replacement fields."""
+
+        if self.template_fields(template):
+            return self.compile_template(template)
+
+        code = compile(template.replace("{{", "{").replace("}}", "}"),
+                       str(self), "exec")
+        return lambda new, old, attr: code
+
+    def poll(self, monitors):
+        """Run the named monitor operations in turn, making each distinct
+        query only once, and return a dictionary of their results (or of the
+        exception raised, for any which failed)."""
+
+        cache = {}
+        results = {}
+        for name in monitors:
+            try:
+                results[name] = self.operations[name](cache=cache)
+            except Exception as e:
+                results[name] = e
+        return results
+
+    def submit(self, operation, *args):
+        """Queue an operation, given by name or as a callable, on the
+        instrument's worker thread, returning a Future holding its result."""
+
+        if isinstance(operation, str):
+            operation = self.operations[operation]
+
+        with self.pending_lock:
+            self.pending += 1
+
+        future = self.worker.submit(operation, *args)
+        future.add_done_callback(self.release)
+        return future
+
+    def release(self, future):
+        with self.pending_lock:
+            self.pending -= 1
+
+    def busy(self):
+        """Returns True while any operation is queued or running on the instrument."""
+        return self.pending > 0
+
+    def close(self):
+        """Stop the widget's polling, and shut down the worker once the
+        operations queued on it are done, closing the device after them."""
+
+        if self.instrument_widget is not None:
+            self.instrument_widget.close()
+
+        self.worker.submit(self.device.close)
+        self.worker.shutdown(wait=False)
+
     def __str__(self):
         return "_".join(self.idn).replace(" ", "").replace("\t", "")
@@ -1,6 +1,15 @@
 import numpy as np
+import re
 from copy import deepcopy
+from functools import partial
+from os import path
+from datetime import datetime
 from bokeh import layouts as bkl, models as bkm, plotting as bkp
+from bokeh.events import RangesUpdate
+from pages.page_system_messages import log
+from recorder import Recorder
+from poll_scheduler import PollScheduler
+from utils import app_config
 
 
 class InstrumentWidget:
@@ -9,7 +18,56 @@ class InstrumentWidget:
         self.inst = instrument
         self.linked_enable = {}
         self.linked_disable = {}
-        self.periodic_polls = {}
+        self.scheduler = PollScheduler(self)
+
+    def dispatch(self, operation, callback, *args):
+        """Run an operation of the instrument on its worker thread, and pass
+        its result to callback on the document's event loop once it is done."""
+
+        doc = bkp.curdoc()
+        future = self.inst.submit(operation, *args)
+        future.add_done_callback(
+            lambda future: doc.add_next_tick_callback(
+                partial(self.deliver, operation, future, callback)))
+        return future
+
+    def deliver(self, operation, future, callback):
+        try:
+            result = future.result()
+        except Exception as e:
+            self.report(operation, e)
+            return
+
+        if callback is not None:
+            callback(result)
+
+    def report(self, operation, e):
+        name = operation if isinstance(operation, str) else operation.__name__
+        log("Exception encountered in "+name+" : "+str(e))
+
+    def close(self):
+        """Stop polling and recording the monitors of the instrument."""
+
+        self.scheduler.stop()
+        for element in self.inst.operations:
+            if element.startswith("monitors:"):
+                self.inst.manager.stop_recording(element)
+
+    def setting_changed(self, element):
+        """Returns a Bokeh on_change callback applying a setting on the worker."""
+
+        def on_change(attr, old, new):
+            self.dispatch(element, None, attr, old, new)
+
+        return on_change
+
+    def recording_filename(self, element):
+        """Returns a new file name to record a monitor to, in the recording
+        directory of the app config."""
+
+        name = "_".join([str(self.inst), element, datetime.now().strftime("%Y%m%d-%H%M%S")])
+        name = re.sub(r"[^\w\-]+", "_", name) + ".h5"
+        return path.join(app_config.get("recording_directory", "recordings"), name)
 
     def generate(self):
 
@@ -80,25 +138,33 @@ class InstrumentWidget:
                             mode="int"
                         )
 
-                    widget.on_change(attr, self.inst.operations[element])
+                    widget.on_change(attr, self.setting_changed(element))
                     layout.append(widget)
 
                 elif "monitors" in locspec:
 
-                    self.periodic_polls.update({element:None})
-
                     if block["type"] == "plot":
-                        cds = bkm.sources.ColumnDataSource({"x": [], "y": []})
-                        self.inst.manager.register(
-                            {element: cds}
-                        )
+                        cds = bkm.sources.ColumnDataSource({"x": np.zeros(0), "y": np.zeros(0)})
 
-                        scatterplot = bkp.figure()
-                        scatterplot.dot(x="x", y="y", source=cds)
-                        
                         lineplot = bkp.figure()
                         lineplot.line(x="x", y="y", source=cds)
 
+                        # Both views share an x range, so that zooming either
+                        # fetches full resolution data for the range in view
+                        scatterplot = bkp.figure(x_range=lineplot.x_range)
+                        scatterplot.dot(x="x", y="y", source=cds)
+
+                        # Traces are sent reduced to the width of the plot
+                        self.inst.manager.register(
+                            {element: cds}, dtype=block.get("dtype"), width=lineplot.width
+                        )
+
+                        def zoom(event, element=element):
+                            self.inst.manager.set_view(element, event.x0, event.x1)
+
+                        lineplot.on_event(RangesUpdate, zoom)
+                        scatterplot.on_event(RangesUpdate, zoom)
+
                         scatterpanel = bkm.Panel(
                             child=scatterplot, title="Scatter"
                         )
@@ -123,49 +189,62 @@ class InstrumentWidget:
                             active=False
                         )
                         
-                        def polling_methods(element):
+                        def polling_methods(element, refresh_rate_input):
 
-                            def poll():
-                                to_stream = self.inst.operations[element]()
-                                datalen = len(to_stream["x"]) if "x" in to_stream else 0
-                                if datalen > 0:
-                                    cds.stream(to_stream, datalen)
+                            def stream(to_stream):
+                                self.inst.manager.append(element, to_stream)
 
-                            def enable_poll(old, new, attr):
+                            # Polling is scheduled alongside every other
+                            # monitor of the instrument
+                            def enable_poll(attr, old, new):
                                 if new:
                                     refresh_rate_input.disabled = False
-                                    periodic_poll = bkp.curdoc().add_periodic_callback(poll, refresh_rate_input.value)
-                                    self.periodic_polls.update({element:periodic_poll})
+                                    self.scheduler.enable(element, refresh_rate_input.value, stream)
                                 else:
                                     refresh_rate_input.disabled = True
-                                    bkp.curdoc().remove_periodic_callback(self.periodic_polls[element])
-                                    self.periodic_polls.update({element:None})
-
-                            def update_poll_interval(old, new, attr):
-                                cd = bkp.curdoc()
-                                if old != new and self.periodic_polls[element] is not None:
-                                    cd.remove_periodic_callback(self.periodic_polls[element])
-                                    new_poll = cd.add_periodic_callback(poll, new)
-                                    self.periodic_polls.update({element:new_poll})
-                            
-                            return poll, enable_poll, update_poll_interval
-                        
-                        poll, enable_poll, update_poll_interval = polling_methods(element)
+                                    self.scheduler.disable(element)
+
+                            def update_poll_interval(attr, old, new):
+                                if old != new:
+                                    self.scheduler.set_interval(element, new)
+
+                            return enable_poll, update_poll_interval
+
+                        enable_poll, update_poll_interval = polling_methods(element, refresh_rate_input)
                         enable_rtm.on_change("active", enable_poll)
 
+                        # Traces are recorded to file on a background thread,
+                        # in the layout read by cassie
+                        enable_recording = bkm.Toggle(
+                            label="Record",
+                            active=False
+                        )
+
+                        def toggle_recording(attr, old, new, element=element):
+                            if new:
+                                filename = self.recording_filename(element)
+                                self.inst.manager.start_recording(element, Recorder(filename))
+                                log("Recording " + element + " to " + filename)
+                            else:
+                                recorder = self.inst.manager.stop_recording(element)
+                                if recorder is not None:
+                                    log("Stopped recording to " + recorder.filename)
+
+                        enable_recording.on_change("active", toggle_recording)
+
                         
                         
                         refresh_rate_input.on_change("value", update_poll_interval)
 
 
-                        widget = bkl.column([plots, bkl.row([refresh_rate_input, enable_rtm])])
+                        widget = bkl.column([plots, bkl.row([refresh_rate_input, enable_rtm, enable_recording])])
 
                         layout.append(widget)
 
                     if block["type"] == "num":
-                        cds = bkm.sources.ColumnDataSource({"x": []})
+                        cds = bkm.sources.ColumnDataSource({"x": np.zeros(0)})
                         self.inst.manager.register(
-                            {element: cds}
+                            {element: cds}, dtype=block.get("dtype")
                         )
                         pass
 
@@ -1,7 +1,12 @@
 import pyvisa as pv
 from bokeh import models as bkm, layouts as bkl
+from bokeh.io import curdoc
+
+from threading import Thread
+from functools import partial
 
 from data_manager import DataManager
+from utils import app_config
 
 from .page_system_messages import log
 
@@ -9,40 +14,61 @@ page = bkm.Panel(title="Instrument Rack",
                             child=bkl.grid([bkm.Div(text="Test 1")]))
 
 
-from instrument import Instrument
+from discovery import probe_ports
 
 rm = pv.ResourceManager()
 dm = DataManager()
+instruments = []  # The instruments loaded into the rack
 visa_refresh_button = bkm.Button(label="Load Instruments", width=200)
 
+def add_instrument(port, future):
+    # Runs on the document's event loop as each port answers (or fails to)
+    try:
+        inst, messages = future.result()
+        for message in messages:
+            log(message)
+
+        instruments.append(inst)
+        visa_ports_display.children += [inst.instrument_widget.generate()]
+        #[bkm.Div(text=port+"\t:</br>"+str(inst))]
+
+    except Exception as e:
+        log("Exception encountered opening port "+port+" : "+str(e))
+        log("Provide a driver file?", bkm.FileInput())
+        #visa_ports_display.children += [bkm.Div(text=port+"\t:</br>"+str(e))]
+
+def no_instruments():
+    message = "No instrument ports were found. Check power and data connections?"
+    log(message)
+
+def discover(doc):
+    # Probe every port from a background thread, so that the event loop is
+    # never blocked, adding each instrument to the rack as it answers
+    timeout = app_config.get("discovery_timeout", 2000)
+
+    def deliver(port, future):
+        doc.add_next_tick_callback(partial(add_instrument, port, future))
+
+    try:
+        if not probe_ports(rm, timeout, dm, deliver):
+            doc.add_next_tick_callback(no_instruments)
+
+    except Exception as e:
+        doc.add_next_tick_callback(partial(log, "Exception encountered listing ports : "+str(e)))
+
+    finally:
+        doc.add_next_tick_callback(partial(visa_refresh_button.update, disabled=False))
+
 def refresh_instruments():
     visa_refresh_button.disabled = True
-
-    ports = rm.list_resources()
     visa_ports_display.children = []
-    if ports:
-        for port in ports:
-            try:
-                candidate = rm.open_resource(port)
-
-                idn = candidate.query("*IDN?")
-                idn = idn.replace("*", "").replace("IDN", "").replace(".", "-").strip()
-
-                inst = Instrument(candidate, dm, *(idn.split(",")[:4]))
-                inst.load_config()
-
-                visa_ports_display.children += [inst.instrument_widget.generate()]
-                #[bkm.Div(text=port+"\t:</br>"+str(inst))]
-
-            except Exception as e:
-                log("Exception encountered opening port "+port+" : "+str(e))
-                log("Provide a driver file?", bkm.FileInput())
-                #visa_ports_display.children += [bkm.Div(text=port+"\t:</br>"+str(e))]
-    else:
-        message = "No instrument ports were found. Check power and data connections?"
-        log(message)
-    
-    visa_refresh_button.disabled = False
+
+    # The ports are opened afresh, so release those of the last load
+    for inst in instruments:
+        inst.close()
+    instruments.clear()
+
+    Thread(target=discover, args=(curdoc(),), daemon=True).start()
 
 
 visa_refresh_button.on_click(refresh_instruments)
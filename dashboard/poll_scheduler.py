@@ -0,0 +1,96 @@
+from math import gcd
+from time import monotonic
+
+from bokeh import plotting as bkp
+
+
+class PollScheduler:
+    """Owns the periodic polling of every monitor of an instrument, through a
+    single periodic callback. Each cycle polls the monitors that are due in
+    one operation on the instrument's worker, in which identical queries are
+    made only once, and hands the results of each monitor to its callback."""
+
+    def __init__(self, widget, resolution=50) -> None:
+        self.widget = widget  # The InstrumentWidget the monitors belong to
+        self.resolution = resolution  # The shortest period of the callback, in ms
+
+        self.intervals = {}  # The polling interval of each enabled monitor, in ms
+        self.due = {}  # The time each enabled monitor is next due to be polled
+        self.callbacks = {}  # The callback passed the results of each monitor
+
+        self.doc = None
+        self.periodic_callback = None
+        self.period = None
+
+    def enable(self, element, interval, callback):
+        """Poll a monitor every interval ms, passing its results to callback
+        on the document's event loop."""
+
+        self.intervals[element] = int(interval)
+        self.callbacks[element] = callback
+        self.due[element] = monotonic()
+        self.reschedule()
+
+    def disable(self, element):
+        self.intervals.pop(element, None)
+        self.due.pop(element, None)
+        self.reschedule()
+
+    def stop(self):
+        """Stop polling every monitor."""
+
+        self.intervals.clear()
+        self.due.clear()
+        self.reschedule()
+
+    def set_interval(self, element, interval):
+        if element in self.intervals:
+            self.due[element] += (int(interval) - self.intervals[element])/1000
+            self.intervals[element] = int(interval)
+            self.reschedule()
+
+    def reschedule(self):
+        # Tick at the greatest common divisor of the enabled intervals, so that
+        # every monitor is polled on time, but no faster than the resolution
+        period = None
+        if self.intervals:
+            period = max(self.resolution, gcd(*self.intervals.values()))
+
+        if period == self.period:
+            return
+
+        if self.doc is None:
+            self.doc = bkp.curdoc()
+
+        if self.periodic_callback is not None:
+            self.doc.remove_periodic_callback(self.periodic_callback)
+            self.periodic_callback = None
+
+        if period is not None:
+            self.periodic_callback = self.doc.add_periodic_callback(self.tick, period)
+        self.period = period
+
+    def tick(self):
+        # Skip this cycle rather than queue it behind an instrument that is
+        # still busy, leaving the monitors due for the next one
+        if self.widget.inst.busy():
+            return
+
+        # Allow for jitter of up to half a period in the callback
+        now = monotonic()
+        due = [element for element, t in self.due.items()
+               if t <= now + self.period/2000]
+        if not due:
+            return
+
+        for element in due:
+            self.due[element] = max(self.due[element] + self.intervals[element]/1000, now)
+
+        self.widget.dispatch(self.widget.inst.poll, self.deliver, due)
+
+    def deliver(self, results):
+        for element, result in results.items():
+            if isinstance(result, Exception):
+                self.widget.report(element, result)
+            elif element in self.callbacks:
+                self.callbacks[element](result)
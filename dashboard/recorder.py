@@ -0,0 +1,129 @@
+from os import path, makedirs
+from queue import Queue, Empty
+from threading import Thread
+from time import time, monotonic
+
+import h5py as h5
+import numpy as np
+
+
+class Recorder:
+    """A background writer recording the traces of a monitor to an HDF5 file
+    in the layout of a cassie scan: each trace is a row of the osc_0 dataset,
+    and the matching row of the analysis dataset holds the scan point it was
+    taken at (which cassie groups traces by), the time it was taken and its
+    index. The file is written in SWMR mode, so it can be read (for example
+    by cassie.follow_process) while it is being recorded."""
+
+    def __init__(self, filename, dtype=None, batch_rows=64, flush_interval=1.,
+                 compression="gzip", chunk_rows=1, point=0.) -> None:
+        self.filename = filename  # The file to record to, created (or overwritten) on the first write
+        self.dtype = dtype  # The dtype traces are stored as, by default that of the first trace
+        self.point = point  # The scan point traces are taken at, unless given with a trace
+
+        # Traces are written in batches, whenever batch_rows traces are waiting
+        # or flush_interval seconds have passed since the last write
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+
+        self.compression = compression  # The compression filter of the datasets
+        self.chunk_rows = chunk_rows  # The number of traces in each chunk. A compressed chunk is
+        # rewritten (and often moved, leaving its old space unused) by every write to it, so this
+        # should not exceed the number of traces in a typical write
+
+        self.rows = 0  # The number of traces written
+        self.error = None  # Any exception raised while writing
+
+        self.file = None
+        self.queue = Queue()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, trace, x=None, timestamp=None, point=None):
+        """Queue a trace to be written, with its x values (stored once, from
+        the first trace), the time it was taken (by default, now) and the scan
+        point it was taken at (by default, the recorder's point)."""
+
+        if self.error is not None:
+            raise RuntimeError("Recording to " + self.filename + " failed : " + str(self.error))
+        self.queue.put((self.point if point is None else point,
+                        time() if timestamp is None else timestamp, trace, x))
+
+    def close(self, wait=False):
+        """Stop recording once every queued trace is written, optionally
+        waiting for the writer to finish."""
+
+        self.queue.put(None)
+        if wait:
+            self.thread.join()
+
+    def run(self):
+        batch = []
+        last_write = monotonic()
+        stopping = False
+
+        try:
+            while not stopping:
+                try:
+                    item = self.queue.get(timeout=self.flush_interval)
+                except Empty:
+                    item = ()
+
+                if item is None:
+                    stopping = True
+                elif item:
+                    batch.append(item)
+
+                if batch and (stopping or len(batch) >= self.batch_rows
+                              or monotonic() - last_write >= self.flush_interval):
+                    self.write(batch)
+                    batch = []
+                    last_write = monotonic()
+
+        except Exception as e:
+            self.error = e
+
+        finally:
+            if self.file is not None:
+                self.file.close()
+
+    def create(self, samples, dtype, x):
+        # The datasets must all exist before SWMR mode is started
+        makedirs(path.dirname(path.abspath(self.filename)), exist_ok=True)
+        self.file = h5.File(self.filename, "w", libver="latest")
+
+        self.file.create_dataset(
+            "osc_0", shape=(0, samples), maxshape=(None, samples), dtype=dtype,
+            chunks=(self.chunk_rows, samples), compression=self.compression, shuffle=True)
+        self.file.create_dataset(
+            "analysis", shape=(0, 3), maxshape=(None, 3), dtype=np.float64,
+            chunks=(max(self.chunk_rows, 1024), 3), compression=self.compression)
+        if x is not None:
+            self.file.create_dataset("x", data=np.ravel(x), compression=self.compression)
+
+        self.file.swmr_mode = True
+
+    def write(self, batch):
+        points, timestamps, traces, xs = zip(*batch)
+        traces = [np.ravel(trace) for trace in traces]
+
+        if self.file is None:
+            dtype = traces[0].dtype if self.dtype is None else self.dtype
+            self.create(len(traces[0]), dtype, xs[0])
+
+        scope = self.file["osc_0"]
+        analysis = self.file["analysis"]
+
+        if any(len(trace) != scope.shape[1] for trace in traces):
+            raise ValueError("Trace length changed while recording to " + self.filename)
+
+        start, stop = self.rows, self.rows + len(traces)
+        scope.resize(stop, axis=0)
+        scope[start:stop] = np.stack(traces)
+        analysis.resize(stop, axis=0)
+        analysis[start:stop] = np.column_stack((points, timestamps, np.arange(start, stop)))
+
+        # Make the new rows visible to readers
+        scope.flush()
+        analysis.flush()
+        self.rows = stop
@@ -18,5 +18,9 @@ except Exception as e:
     print("Reverting to built-in default config.")
     app_config = {
         "retained_messages": 1400,
+        "discovery_timeout": 2000,
+        "monitor_depth": 1048576,
+        "monitor_dtype": None,
+        "recording_directory": "recordings",
         "software_instruments": []
     }
\ No newline at end of file
@@ -1,7 +1,598 @@
 from .context import cassie
 import numpy as np
-from pytest import approx, raises
+from pytest import approx, raises, mark
 
 def test_basic():
     test = 1
-    assert test == 1
\ No newline at end of file
+    assert test == 1
+
+def test_locate_edges_batch_matches_locate_edges():
+    rng = np.random.default_rng(0)
+    traces = rng.normal(0, 0.0002, (20, 500))
+    for k, trace in enumerate(traces):
+        for loc in rng.integers(0, 495, k % 5):
+            trace[loc:loc+4] -= np.linspace(0.001, 0.004, 4)
+    traces[3, :3] -= 0.01
+
+    edges, offsets = cassie.locate_edges_batch(traces)
+    assert len(offsets) == len(traces) + 1
+    for k, trace in enumerate(traces):
+        assert np.array_equal(edges[offsets[k]:offsets[k+1]], cassie.locate_edges(trace))
+
+
+def test_locate_edges_batch_rejects_1d():
+    with raises(ValueError):
+        cassie.locate_edges_batch(np.zeros(10))
+
+
+def test_iter_chunks_aligns_to_chunks_and_covers_dataset(tmp_path):
+    import h5py as h5
+    traces = np.arange(50*8, dtype = float).reshape(50, 8)
+    with h5.File(tmp_path / "scan.h5", "w") as f:
+        f.create_dataset("osc_0", data = traces, chunks = (4, 8))
+        blocks = [(start, block.copy()) for start, block in cassie.iter_chunks(f["osc_0"], max_bytes = 10*8*8)]
+
+    assert [start for start, _ in blocks] == list(range(0, 50, 8))
+    assert np.array_equal(np.concatenate([block for _, block in blocks]), traces)
+
+
+def test_scan_column_supports_compound_and_2d(tmp_path):
+    import h5py as h5
+    compound = np.array([(1.5, 2), (2.5, 3)], dtype = [("v", float), ("n", int)])
+    with h5.File(tmp_path / "scan.h5", "w") as f:
+        f.create_dataset("compound", data = compound)
+        f.create_dataset("plain", data = np.array([[1.5, 2], [2.5, 3]]))
+        assert np.array_equal(cassie.scan_column(f["compound"]), [1.5, 2.5])
+        assert np.array_equal(cassie.scan_column(f["plain"]), [1.5, 2.5])
+
+
+def test_fit_points_parallel_matches_serial():
+    rng = np.random.default_rng(1)
+    datasets = [cassie.sample_hits(400, p, rng = rng) for p in (0.1, 0.5, 0.9)]
+    fixes = {"q":0.3, "m0":803, "m1":745, "s0":15., "s1":15.}
+    cassie.default_model.fix_params(**fixes)
+    try:
+        serial = cassie.fit_points(datasets, p0 = 0.5)
+        parallel = cassie.fit_points(datasets, p0 = 0.5, workers = 2)
+    finally:
+        cassie.default_model.fix_params(**{name:None for name in fixes})
+
+    assert [popt[0] for popt, _ in parallel] == approx([popt[0] for popt, _ in serial])
+    assert [popt[0] for popt, _ in serial] == approx([0.1, 0.5, 0.9], abs = 0.1)
+
+
+def test_binned_estimate_matches_unbinned():
+    rng = np.random.default_rng(2)
+    hits = cassie.sample_hits(2000, 0.7, rng = rng)
+    fixes = {"q":0.3, "m0":803, "m1":745, "s0":15., "s1":15.}
+    cassie.default_model.fix_params(**fixes)
+    try:
+        unbinned = cassie.MaximumLikelihoodEstimator(cassie.default_model)
+        unbinned.set_data(hits)
+        binned = cassie.MaximumLikelihoodEstimator(cassie.default_model, binned = True)
+        binned.set_data(hits)
+        popt, pcov = unbinned.estimate(p = 0.5)
+        bpopt, bpcov = binned.estimate(p = 0.5)
+    finally:
+        cassie.default_model.fix_params(**{name:None for name in fixes})
+
+    assert bpopt == approx(popt, rel = 1e-6)
+    assert bpcov == approx(pcov, rel = 1e-3)
+
+
+def test_binned_estimator_rejects_non_integer_data():
+    mle = cassie.MaximumLikelihoodEstimator(cassie.default_model, binned = True)
+    with raises(ValueError):
+        mle.set_data(np.array([1.5, 2.0]))
+
+
+def test_default_model_gradient_matches_finite_differences():
+    x = np.arange(0, 1000, 7).reshape(1, -1)
+    params = {"p":0.35, "q":0.2, "m0":790., "m1":750., "s0":12., "s1":18.}
+    names = list(params)
+    cassie.default_model.fix_params(x = x)
+    try:
+        values = [params[name] for name in names]
+        analytic = cassie.default_model.log_gradient(*values)
+        for k, name in enumerate(names):
+            h = 1e-6*max(1, abs(values[k]))
+            up, down = list(values), list(values)
+            up[k] += h
+            down[k] -= h
+            numeric = (np.log(cassie.default_model(*up)) - np.log(cassie.default_model(*down)))/(2*h)
+            assert analytic[k] == approx(numeric, rel = 1e-4, abs = 1e-8)
+    finally:
+        cassie.default_model.fix_params(x = None)
+
+
+def test_log_gradient_requires_gradient():
+    model = cassie.Model(lambda x, a = 1: a*x)
+    assert not model.has_gradient()
+    with raises(TypeError):
+        model.log_gradient(1, 2)
+
+
+def test_memoize_caches_hashable_calls_only():
+    calls = []
+
+    @cassie.memoize(maxsize = 2)
+    def norm(m, s):
+        calls.append((m, s))
+        return np.sum(np.atleast_1d(m))*s
+
+    assert norm(1., 2.) == norm(1., 2.) == 2.
+    assert len(calls) == 1
+    assert norm.cache_info().hits == 1
+
+    assert norm(np.array([1., 2.]), 2.) == 6.
+    assert len(calls) == 2
+
+    norm(2., 2.)
+    norm(3., 2.)
+    norm(1., 2.)
+    assert len(calls) == 5
+
+
+def test_model_call_plan_follows_fix_params():
+    model = cassie.Model(lambda x, a = 1, b = 2, c = 3: (x, a, b, c))
+    assert model(0, 1, 2, 3) == (0, 1, 2, 3)
+
+    model.fix_params(a = 10, c = 30)
+    assert model(0, 2) == (0, 10, 2, 30)
+
+    model.fix_params(a = None, x = 5)
+    assert model(1, 2) == (5, 1, 2, 30)
+
+    with raises(ValueError):
+        model(1, 2, 3)
+    with raises(ValueError):
+        model.fix_params(d = 1)
+
+
+def test_profile_matches_pointwise_likelihood():
+    rng = np.random.default_rng(3)
+    hits = cassie.sample_hits(500, 0.4, rng = rng)
+    fixes = {"q":0.3, "m0":803, "m1":745, "s0":15., "s1":15.}
+    cassie.default_model.fix_params(**fixes)
+    try:
+        mle = cassie.MaximumLikelihoodEstimator(cassie.default_model, binned = True)
+        mle.set_data(hits)
+        grid = np.linspace(0, 1, 11)
+        profile = mle.profile("p", grid)
+        assert cassie.default_model.get_fixed_params() == dict(fixes, nbins = 1000)
+
+        cassie.default_model.fix_params(x = hits)
+        pointwise = [np.sum(np.log(cassie.default_model(value))) for value in grid]
+    finally:
+        cassie.default_model.fix_params(x = None, **{name:None for name in fixes})
+
+    assert profile == approx(pointwise)
+
+
+def test_refit_outliers_repairs_failed_fit():
+    rng = np.random.default_rng(4)
+    truth = np.linspace(0.1, 0.9, 8)
+    datasets = [cassie.sample_hits(400, value, rng = rng) for value in truth]
+    fixes = {"q":0.3, "m0":803, "m1":745, "s0":15., "s1":15.}
+    cassie.default_model.fix_params(**fixes)
+    try:
+        fits = cassie.fit_points(datasets, p0 = 0.5)
+        p = np.array([popt[0] for popt, _ in fits])
+        sigma = np.array([np.sqrt(pcov[0, 0]) for _, pcov in fits])
+        p[2], sigma[2] = 0.99, 1.
+        cassie.refit_outliers(datasets, p, sigma, timeout = 30)
+    finally:
+        cassie.default_model.fix_params(**{name:None for name in fixes})
+
+    assert sigma[2] < 0.2
+    assert p == approx(truth, abs = 0.15)
+
+
+def test_refit_outliers_tries_every_start(monkeypatch):
+    rng = np.random.default_rng(1)
+    fixes = {"q":0.3, "m0":803, "m1":745, "s0":15., "s1":15.}
+    truth = [0.2, 0.4, 0.5, 0.6, 0.8, 1.0]
+    datasets = [cassie.sample_hits(300, value, rng = rng, **fixes) for value in truth]
+
+    starts = []
+    fit_points = cassie.cassie.fit_points
+    def recording_fit_points(datasets, p0 = 0, **kwargs):
+        starts.extend(p0)
+        return fit_points(datasets, p0 = p0, **kwargs)
+    monkeypatch.setattr(cassie.cassie, "fit_points", recording_fit_points)
+
+    cassie.default_model.fix_params(**fixes)
+    try:
+        fits = fit_points(datasets, p0 = 0.5)
+        p = np.array([popt[0] for popt, _ in fits])
+        sigma = np.array([np.sqrt(pcov[0, 0]) for _, pcov in fits])
+        cassie.refit_outliers(datasets, p, sigma, n_starts = 5)
+    finally:
+        cassie.default_model.fix_params(**{name:None for name in fixes})
+
+    #The fit at the bound is an outlier. Its starts at and next to the bound would only repeat it, so are skipped,
+    #and every other start is tried in turn
+    assert p[-1] == approx(1.)
+    assert len(starts) == 3
+    assert all(abs(start - 1.) > 0.015 for start in starts)
+
+
+def test_default_process_shares_one_pool_of_workers(tmp_path, monkeypatch):
+    from concurrent.futures import ProcessPoolExecutor
+    pools = []
+    class CountingExecutor(ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(self)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(cassie.cassie, "ProcessPoolExecutor", CountingExecutor)
+
+    filename = str(tmp_path / "scan.h5")
+    cassie.generate_scan(filename, points = (0., 0.5, 1.), shots = 20, seed = 7)
+    for uncertainty in ('hessian', 'bootstrap'):
+        pools.clear()
+        x, p, sigma = cassie.default_process(filename, verbose = False, use_index = False, workers = 2,
+                                             uncertainty = uncertainty, n_resamples = 50)
+        assert len(pools) == 1
+        assert np.all(np.isfinite(sigma))
+
+
+def test_estimate_joint_matches_pointwise_fits():
+    rng = np.random.default_rng(5)
+    truth = [0.2, 0.5, 0.8]
+    datasets = [cassie.sample_hits(600, value, rng = rng) for value in truth]
+    hits = np.concatenate(datasets)
+    offsets = np.cumsum([0] + [len(d) for d in datasets])
+    fixes = {"q":0.3, "m0":803, "m1":745, "s0":15., "s1":15.}
+
+    results = []
+    for binned in (False, True):
+        cassie.default_model.fix_params(**fixes)
+        mle = cassie.MaximumLikelihoodEstimator(cassie.default_model, binned = binned)
+        mle.set_data(hits)
+        results.append(mle.estimate_joint(offsets, p = 0.5))
+        assert cassie.default_model.get_fixed_params() == dict(fixes, nbins = 1000)
+
+    fits = cassie.fit_points(datasets, p0 = 0.5)
+    cassie.default_model.fix_params(**{name:None for name in fixes})
+    pointwise = [popt[0] for popt, _ in fits]
+    pointwise_sigma = [np.sqrt(pcov[0, 0]) for _, pcov in fits]
+
+    #The points share no parameters, so the joint covariance matches that of each point's own fit
+    for popt, pcov in results:
+        assert popt == approx(pointwise, abs = 1e-4)
+        assert np.shape(pcov) == (3, 3)
+        assert np.sqrt(np.diag(pcov)) == approx(pointwise_sigma, rel = 0.02)
+        assert pcov[0, 1] == approx(0, abs = 1e-6)
+
+
+def test_estimate_joint_fits_shared_parameters():
+    rng = np.random.default_rng(6)
+    truth = [0.2, 0.5, 0.8]
+    datasets = [cassie.sample_hits(4000, value, q = 0.7, rng = rng) for value in truth]
+    hits = np.concatenate(datasets)
+    offsets = np.cumsum([0] + [len(d) for d in datasets])
+
+    mle = cassie.MaximumLikelihoodEstimator(cassie.default_model, binned = True)
+    mle.set_data(hits)
+    popt, pcov = mle.estimate_joint(offsets, p = 0.5, q = 0.5, m0 = 795., m1 = 739., s0 = 10., s1 = 20.)
+    assert len(popt) == 5 + len(truth)
+    assert np.shape(pcov) == (len(popt), len(popt))
+    assert popt[:5] == approx([0.7, 803, 745, 15., 15.], rel = 0.1)
+    assert popt[5:] == approx(truth, abs = 0.1)
+    assert np.all(np.sqrt(np.diag(pcov)[5:]) < 0.05)
+
+
+def test_default_process_joint_matches_serial_uncertainty(tmp_path):
+    filename = str(tmp_path / "scan.h5")
+    cassie.generate_scan(filename, points = np.linspace(0, 1, 9), shots = 100, seed = 2)
+    x, p, sigma = cassie.default_process(filename, verbose = False, use_index = False)
+    x, p_joint, sigma_joint = cassie.default_process(filename, verbose = False, use_index = False, joint = True)
+
+    assert p_joint == approx(p, abs = 0.02)
+    assert sigma_joint == approx(sigma, rel = 0.1)
+
+
+def test_hit_store_groups_hits_by_point():
+    store = cassie.HitStore()
+    store.add(np.array([5, 6, 7, 8]), np.array([0, 1, 3, 4]), np.array([2., 1., 2.]))
+    store.add(np.array([9, 10]), np.array([0, 0, 2]), np.array([1., 3.]))
+
+    assert np.array_equal(store.get_points(), [1., 2., 3.])
+    assert np.array_equal(store.get_offsets(), [0, 2, 4, 6])
+    assert store.get_hits().dtype == np.int32
+    assert [store[k].tolist() for k in range(len(store))] == [[6, 7], [5, 8], [9, 10]]
+    assert np.shares_memory(store[1], store.get_hits())
+
+    store.add(np.array([11]), np.array([0, 1]), np.array([2.]))
+    assert [store[k].tolist() for k in range(len(store))] == [[6, 7], [5, 8, 11], [9, 10]]
+
+    with raises(ValueError):
+        store.add(np.array([1]), np.array([0, 1]), np.array([1., 2.]))
+
+
+def test_hit_index_round_trip_and_invalidation(tmp_path):
+    import h5py as h5
+    filename = str(tmp_path / "scan.h5")
+    cassie.generate_scan(filename, points = (0., 0.5, 1.), shots = 20, seed = 7)
+    with h5.File(filename, "r") as f:
+        traces = f["osc_0"][:]
+    key = cassie.hit_index_key(filename, traces.shape)
+    assert cassie.load_hit_index(filename, key) is None
+
+    writer = cassie.HitIndexWriter(filename, key)
+    for start in range(0, len(traces), 16):
+        writer.add(*cassie.locate_edges_batch(traces[start:start+16]))
+    writer.close()
+
+    edges, offsets = cassie.load_hit_index(filename, key)
+    expected_edges, expected_offsets = cassie.locate_edges_batch(traces)
+    assert isinstance(edges, np.memmap)
+    assert np.array_equal(edges, expected_edges)
+    assert np.array_equal(offsets, expected_offsets)
+
+    assert cassie.load_hit_index(filename, cassie.hit_index_key(filename, traces.shape, val_threshold = 0.001)) is None
+    with open(filename, "ab") as f:
+        f.write(b"\0")
+    assert cassie.load_hit_index(filename, cassie.hit_index_key(filename, traces.shape)) is None
+
+
+def test_default_process_reuses_hit_index(tmp_path, monkeypatch):
+    filename = str(tmp_path / "scan.h5")
+    cassie.generate_scan(filename, points = (0., 0.5, 1.), shots = 20, seed = 7)
+    first = cassie.default_process(filename, verbose = False, refit_rounds = 0)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Edges were located despite a valid hit index")
+    monkeypatch.setattr(cassie.cassie, "locate_edges_batch", fail)
+
+    second = cassie.default_process(filename, verbose = False, refit_rounds = 0)
+    for a, b in zip(first, second):
+        assert np.array_equal(a, b)
+
+
+def test_default_process_carries_on_when_hit_index_fails(tmp_path, monkeypatch, capsys):
+    import os
+    filename = str(tmp_path / "scan.h5")
+    cassie.generate_scan(filename, points = (0., 0.5, 1.), shots = 20, seed = 7)
+    expected = cassie.default_process(filename, verbose = False, refit_rounds = 0, use_index = False, chunk_bytes = 2**16)
+
+    def fail(self, edges, offsets):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(cassie.HitIndexWriter, "add", fail)
+
+    result = cassie.default_process(filename, verbose = False, refit_rounds = 0, chunk_bytes = 2**16)
+    for a, b in zip(expected, result):
+        assert np.array_equal(a, b)
+    assert not os.path.exists(os.path.join(filename + ".hits", "meta.json"))
+    assert capsys.readouterr().out == ""
+
+
+def test_hit_store_keeps_loaded_hit_index_without_copying(tmp_path):
+    import h5py as h5
+    filename = str(tmp_path / "scan.h5")
+    cassie.generate_scan(filename, points = (0., 0.5, 1.), shots = 20, seed = 7)
+    cassie.default_process(filename, verbose = False, refit_rounds = 0)
+    with h5.File(filename, "r") as f:
+        key = cassie.hit_index_key(filename, f["osc_0"].shape)
+        values = cassie.scan_column(f["analysis"])
+    edges, offsets = cassie.load_hit_index(filename, key)
+
+    store = cassie.HitStore()
+    store.add(edges, offsets, values)
+    assert np.shares_memory(store.get_hits(), edges)
+    assert np.array_equal(store.get_offsets(), [0, offsets[20], offsets[40], offsets[60]])
+
+
+def test_follow_process_updates_as_scan_grows(tmp_path):
+    import h5py as h5
+    source = str(tmp_path / "source.h5")
+    cassie.generate_scan(source, points = (0., 0.5, 1.), shots = 20, seed = 7)
+    with h5.File(source, "r") as f:
+        traces = f["osc_0"][:]
+        analysis = f["analysis"][:]
+
+    filename = str(tmp_path / "live.h5")
+    with h5.File(filename, "w", libver = "latest") as f:
+        scope = f.create_dataset("osc_0", shape = (0, traces.shape[1]), maxshape = (None, traces.shape[1]), dtype = traces.dtype, chunks = (8, traces.shape[1]))
+        column = f.create_dataset("analysis", shape = (0, 2), maxshape = (None, 2), dtype = analysis.dtype, chunks = (8, 2))
+        f.swmr_mode = True
+
+        def append(rows):
+            for dataset, values in ((scope, traces[rows]), (column, analysis[rows])):
+                dataset.resize(rows.stop, axis = 0)
+                dataset[rows] = values
+                dataset.flush()
+
+        append(slice(0, 20))
+        follower = cassie.follow_process(filename, poll_interval = 0.01, idle_timeout = 0.1, refit_rounds = 0)
+        x, p, sigma = next(follower)
+        assert np.array_equal(x, [0.])
+
+        append(slice(20, 60))
+        x, p, sigma = next(follower)
+        assert np.array_equal(x, [0., 0.5, 1.])
+        assert len(p) == len(sigma) == 3
+
+        with raises(StopIteration):
+            next(follower)
+
+
+def test_cli_processes_files_into_one_output(tmp_path):
+    import h5py as h5
+    from cassie import cli
+    for n, seed in (("001", 8), ("002", 9)):
+        cassie.generate_scan(str(tmp_path / ("20201221_" + n + "_scan.h5")), points = (0., 0.5, 1.), shots = 20, seed = seed)
+    output = str(tmp_path / "results.h5")
+
+    status = cli.main([str(tmp_path / "*_scan.h5"), "-o", output, "-j", "2", "--refit-rounds", "0"])
+
+    assert status == 0
+    with h5.File(output, "r") as f:
+        assert sorted(f) == ["20201221_001_scan", "20201221_002_scan"]
+        group = f["20201221_001_scan"]
+        assert np.array_equal(group["x"][:], [0., 0.5, 1.])
+        assert group["p"].shape == group["sigma"].shape == (3,)
+        assert len(group["popt"]) == len(group.attrs["names"]) == 6
+        assert group.attrs["refit_rounds"] == 0
+        assert group.attrs["refit_timeout"] == "None"
+
+
+def test_cli_keeps_scans_sharing_a_name_apart(tmp_path):
+    import os
+    import h5py as h5
+    from cassie import cli
+    for n, seed in (("a", 8), ("b", 9)):
+        os.makedirs(str(tmp_path / n))
+        cassie.generate_scan(str(tmp_path / n / "x_scan.h5"), points = (0., 0.5, 1.), shots = 20, seed = seed)
+    output = str(tmp_path / "results.h5")
+
+    status = cli.main([str(tmp_path / "*" / "x_scan.h5"), "-o", output, "-j", "1", "--refit-rounds", "0"])
+
+    assert status == 0
+    with h5.File(output, "r") as f:
+        assert sorted(f) == ["a_x_scan", "b_x_scan"]
+        assert f["a_x_scan"].attrs["source"] == str(tmp_path / "a" / "x_scan.h5")
+
+    assert cli.group_names(["/data/x_scan.h5", "/data/y_scan.h5"]) == ["x_scan", "y_scan"]
+    with raises(ValueError):
+        cli.group_names(["/data/x_scan.h5", "/data/x_scan.hdf5"])
+
+
+def test_generate_scan_is_recovered_by_default_process(tmp_path):
+    filename = str(tmp_path / "scan.h5")
+    truth = cassie.generate_scan(filename, points = np.linspace(0, 1, 5), shots = 200, seed = 10)
+    x, p, sigma = cassie.default_process(filename, verbose = False, use_index = False)
+
+    assert np.array_equal(x, np.linspace(0, 1, 5))
+    assert p == approx(truth, abs = 0.2)
+
+
+def test_fit_result_records_fit_and_unpacks():
+    rng = np.random.default_rng(11)
+    recorder = cassie.FitRecorder()
+    mle = cassie.MaximumLikelihoodEstimator(cassie.default_model, binned = True)
+    mle.add_hook(recorder)
+    mle.set_data(cassie.sample_hits(2000, 0.6, q = 0.7, rng = rng))
+
+    result = mle.estimate(p = 0.5, q = 0.5, m0 = 795., m1 = 739., s0 = 10., s1 = 20.)
+    popt, pcov = result
+
+    assert recorder.results == [result]
+    assert result.names == ["p", "q", "m0", "m1", "s0", "s1"]
+    assert result.nfev > 0 and result.njev > 0 and result.nit > 0
+    assert set(result.timings) == {"setup", "optimise", "covariance"}
+    assert recorder.summary()["fits"] == 1
+    assert np.shape(pcov) == (6, 6)
+
+
+def test_failed_fit_is_reported_not_raised():
+    #Well behaved at the initial estimate, so the failure happens during optimisation
+    def broken(x, a = 1.):
+        if a != 1.:
+            raise RuntimeError("broken model")
+        return np.ones_like(x, dtype = float)
+
+    recorder = cassie.FitRecorder()
+    mle = cassie.MaximumLikelihoodEstimator(cassie.Model(broken))
+    mle.add_hook(recorder)
+    mle.set_data(np.array([1., 2., 3.]))
+    result = mle.estimate(a = 1.)
+
+    assert not result.success
+    assert "broken model" in result.message
+    assert np.all(np.isnan(result.popt))
+    assert recorder.summary()["failures"] == 1
+
+
+def test_default_process_hook_tags_every_fit(tmp_path):
+    filename = str(tmp_path / "scan.h5")
+    cassie.generate_scan(filename, points = (0., 0.5, 1.), shots = 20, seed = 12)
+    recorder = cassie.FitRecorder()
+    cassie.default_process(filename, verbose = False, use_index = False, hook = recorder)
+
+    tags = [result.tag for result in recorder.results]
+    assert tags[:4] == ["global", ("fit", 0.), ("fit", 0.5), ("fit", 1.)]
+    assert all(tag[0] == "refit" for tag in tags[4:])
+
+
+def test_bootstrap_matches_hessian_uncertainty():
+    rng = np.random.default_rng(5)
+    fixes = dict(q = 0.7, m0 = 795., m1 = 736., s0 = 17., s1 = 11.)
+    model = cassie.Model(cassie.default_model.__wrapped__)
+    model.set_bounds(p = (0, 1))
+    model.fix_params(nbins = 1000, **fixes)
+    mle = cassie.MaximumLikelihoodEstimator(model, binned = True)
+    mle.set_data(cassie.sample_hits(2000, 0.3, rng = rng, **fixes))
+
+    popt, pcov = mle.estimate(p = 0.5)
+    estimate, replicas = mle.bootstrap('p', np.linspace(0, 1, 201), n_resamples = 400, rng = 1)
+
+    assert estimate == approx(popt[0], abs = 1e-3)
+    assert len(replicas) == 400
+    assert np.std(replicas) == approx(np.sqrt(pcov[0, 0]), rel = 0.2)
+    with raises(ValueError):
+        mle.bootstrap('p', [0., 1.])
+
+
+def test_default_process_bootstrap_skips_refits(tmp_path):
+    filename = str(tmp_path / "scan.h5")
+    cassie.generate_scan(filename, points = (0., 0.5, 1.), shots = 20, seed = 7)
+    recorder = cassie.FitRecorder()
+    x, p, sigma = cassie.default_process(filename, verbose = False, use_index = False, hook = recorder,
+                                         uncertainty = 'bootstrap', n_resamples = 100)
+
+    assert np.all(np.isfinite(sigma)) and np.all(sigma > 0)
+    assert not any(result.tag[0] == 'refit' for result in recorder.results[1:])
+    with raises(ValueError):
+        cassie.default_process(filename, verbose = False, uncertainty = 'bayesian')
+
+
+@mark.filterwarnings("ignore::RuntimeWarning")
+def test_bootstrap_of_empty_point_is_nan(tmp_path):
+    p, sigma = cassie.bootstrap_points([np.array([]), np.array([790., 800., 736.])], n_resamples = 20, seed = 0)
+    assert np.isnan(p[0]) and np.isnan(sigma[0])
+    assert np.isfinite(p[1]) and np.isfinite(sigma[1])
+
+    #Scan points without a single hit must not stop the whole scan
+    filename = str(tmp_path / "scan.h5")
+    cassie.generate_scan(filename, points = np.linspace(0, 1, 6), shots = 2, hit_rate = 0.3, seed = 3)
+    x, p, sigma = cassie.default_process(filename, verbose = False, use_index = False, uncertainty = 'bootstrap',
+                                         n_resamples = 20)
+    assert len(x) == len(sigma) == 6
+    assert np.any(np.isnan(sigma))
+
+
+def test_evaluate_batch_matches_single_calls():
+    x = np.arange(0, 1000, 7).reshape((1, -1))
+    params = np.array([[0.2, 0.7, 795., 736.], [0.9, 0.1, 800., 700.], [0.5, 0.5, 790., 745.]])
+    model = cassie.default_model
+    model.fix_params(x = x, p = None, q = None, m0 = None, m1 = None, s0 = 17., s1 = 11.)
+    try:
+        batch = model.evaluate_batch(params)
+        single = np.array([model(*row) for row in params])
+    finally:
+        model.fix_params(x = None, s0 = None, s1 = None)
+    assert batch.shape == (3, 1, x.size)
+    assert batch == approx(single)
+
+    looped = cassie.Model(lambda x, a = 1., b = 2. : float(a*x + b))
+    looped.fix_params(x = 3.)
+    assert not looped.is_vectorised()
+    assert looped.evaluate_batch([[1., 0.], [2., 1.]]) == approx([3., 7.])
+    with raises(ValueError):
+        looped.evaluate_batch([1., 2.])
+
+
+def test_grid_search_picks_best_starting_values():
+    rng = np.random.default_rng(9)
+    mle = cassie.MaximumLikelihoodEstimator(cassie.default_model, binned = True)
+    mle.set_data(cassie.sample_hits(3000, 0.3, q = 0.7, m0 = 795., m1 = 736., s0 = 17., s1 = 11., rng = rng))
+
+    p = np.linspace(0, 1, 11)
+    m1 = np.linspace(700, 770, 8)
+    best, loglike = mle.grid_search(m1 = m1, p = p, q = 0.7, m0 = 795., s0 = 17., s1 = 11., max_bytes = 2**12)
+    assert loglike.shape == (8, 11, 1, 1, 1, 1)
+    assert best['p'] == approx(0.3) and best['m1'] == approx(740.)
+
+    with raises(ValueError):
+        mle.grid_search(r = [1., 2.])
@@ -0,0 +1,427 @@
+import os
+import sys
+import types
+from threading import Event
+
+import numpy as np
+from pytest import raises
+
+from .context import cassie
+
+#The dashboard imports its modules from its own directory
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'dashboard')))
+
+#Its pages and widgets need a running Bokeh document, so they are replaced by stubs, with logged
+#messages collected in messages
+messages = []
+pages = types.ModuleType("pages")
+pages.page_system_messages = types.ModuleType("pages.page_system_messages")
+pages.page_system_messages.log = lambda msg, resolver = None : messages.append(msg)
+sys.modules.setdefault("pages", pages)
+sys.modules.setdefault("pages.page_system_messages", pages.page_system_messages)
+instrument_widget = types.ModuleType("instrument_widget")
+instrument_widget.InstrumentWidget = lambda instrument : None
+sys.modules.setdefault("instrument_widget", instrument_widget)
+
+#Where Bokeh cannot be imported, a stub takes its place, as every test supplies its own document
+try:
+    from bokeh import plotting
+except Exception:
+    bokeh = sys.modules.setdefault("bokeh", types.ModuleType("bokeh"))
+    sys.modules["bokeh.plotting"] = bokeh.plotting = types.ModuleType("bokeh.plotting")
+
+
+class FakeDevice:
+    """Stands in for an open VISA instrument, recording every command sent to it"""
+
+    def __init__(self, answers = None):
+        self.answers = {} if answers is None else answers
+        self.log = []
+
+    def query(self, command):
+        self.log.append(("query", command))
+        return self.answers[command]
+
+    def write(self, command):
+        self.log.append(("write", command))
+
+    def close(self):
+        self.log.append(("close", None))
+
+
+class FakeDocument:
+    """Stands in for a Bokeh document, holding its periodic callbacks"""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_periodic_callback(self, callback, period):
+        self.callbacks.append((callback, period))
+        return callback
+
+    def remove_periodic_callback(self, callback):
+        self.callbacks = [entry for entry in self.callbacks if entry[0] is not callback]
+
+
+def test_recorder_writes_one_trace_per_flush_compactly(tmp_path):
+    import h5py as h5
+    from recorder import Recorder
+    filename = str(tmp_path / "monitor.h5")
+    traces = np.random.default_rng(0).normal(size = (32, 20000)).astype(np.float32)
+
+    #Every trace is written on its own, as when traces arrive slower than the flush interval
+    recorder = Recorder(filename, batch_rows = 1)
+    for trace in traces:
+        recorder.add(trace)
+    recorder.close(wait = True)
+
+    assert recorder.error is None
+    assert os.path.getsize(filename) < 1.5*traces.nbytes
+    with h5.File(filename, "r") as f:
+        assert np.array_equal(f["osc_0"][:], traces)
+
+
+def test_recorder_stores_scan_point_in_first_analysis_column(tmp_path):
+    import h5py as h5
+    from recorder import Recorder
+    filename = str(tmp_path / "monitor.h5")
+
+    recorder = Recorder(filename)
+    for k in range(4):
+        recorder.add(np.full(10, k), timestamp = 100. + k, point = 1. if k == 3 else None)
+    recorder.close(wait = True)
+
+    #Traces without a scan point of their own are all grouped at the recorder's point
+    with h5.File(filename, "r") as f:
+        assert np.array_equal(cassie.scan_column(f["analysis"]), [0., 0., 0., 1.])
+        assert np.array_equal(f["analysis"][:, 1:], [[100., 0.], [101., 1.], [102., 2.], [103., 3.]])
+
+
+def test_ring_buffer_wraps_around():
+    from data_manager import RingBuffer
+    buffer = RingBuffer(5)
+    assert buffer.times is None and len(buffer.read()[0]) == 0
+    buffer.append({"y" : np.arange(3.)}, timestamp = 1.)
+    assert len(buffer) == 3
+    times, columns = buffer.read()
+    assert np.array_equal(times, [1., 1., 1.]) and np.array_equal(columns["y"], [0., 1., 2.])
+
+    #Filling past the depth overwrites the oldest samples, which are read back oldest first
+    buffer.append({"y" : np.arange(3., 7.)}, timestamp = 2.)
+    assert len(buffer) == 5 and buffer.head == 7
+    times, columns = buffer.read()
+    assert np.array_equal(times, [1., 2., 2., 2., 2.])
+    assert np.array_equal(columns["y"], [2., 3., 4., 5., 6.])
+    assert np.array_equal(buffer.unroll(buffer.columns["y"]), [2., 3., 4., 5., 6.])
+
+    times, columns = buffer.read(start = 2.)
+    assert np.array_equal(columns["y"], [3., 4., 5., 6.])
+    times, columns = buffer.read(stop = 2.)
+    assert np.array_equal(columns["y"], [2.])
+
+    #The latest append is read back whole, even when split by the end of the buffer
+    assert np.array_equal(buffer.latest()["y"], [3., 4., 5., 6.])
+    buffer.append({"y" : np.arange(7., 9.)}, timestamp = 3.)
+    assert np.shares_memory(buffer.latest()["y"], buffer.columns["y"])
+    assert np.array_equal(buffer.latest()["y"], [7., 8.])
+
+
+def test_ring_buffer_keeps_the_end_of_a_long_append():
+    from data_manager import RingBuffer
+    buffer = RingBuffer(5, dtype = {"y" : np.float32})
+    buffer.append({"x" : np.arange(2), "y" : np.arange(2)}, timestamp = 1.)
+    buffer.append({"x" : np.arange(12), "y" : np.arange(12.)}, timestamp = 2.)
+
+    times, columns = buffer.read()
+    assert buffer.head == 14
+    assert np.array_equal(times, np.full(5, 2.))
+    assert np.array_equal(columns["x"], np.arange(7, 12))
+    assert np.array_equal(columns["y"], np.arange(7, 12))
+    assert columns["y"].dtype == np.float32
+
+    #Complex samples are not truncated to the real dtype requested
+    buffer = RingBuffer(5, dtype = np.float32)
+    buffer.append({"y" : np.array([1 + 1j])})
+    assert buffer.read()[1]["y"][0] == 1 + 1j
+    with raises(ValueError):
+        buffer.append({"x" : np.arange(2), "y" : np.arange(3)})
+
+
+def test_envelope_keeps_extremes_of_each_bin():
+    from data_manager import envelope
+    assert np.array_equal(envelope(np.arange(20.), 10), np.arange(20))
+
+    y = np.random.default_rng(3).normal(size = 1003)
+    idx = envelope(y, 10)
+    assert np.all(np.diff(idx) > 0) and idx[-1] < len(y)
+    assert len(idx) <= 20
+    assert np.argmin(y) in idx and np.argmax(y) in idx
+
+    #Every run of samples, including the short final one, keeps its own minimum and maximum
+    run = -(-len(y)//10)
+    for start in range(0, len(y), run):
+        segment = y[start:start + run]
+        assert start + np.argmin(segment) in idx and start + np.argmax(segment) in idx
+
+
+def test_data_manager_sends_envelope_of_view():
+    from data_manager import DataManager
+    source = types.SimpleNamespace(data = {})
+    manager = DataManager()
+    manager.register({"trace" : source}, depth = 4096, width = 10)
+
+    x = np.arange(1000.)
+    y = np.sin(x/50)
+    manager.append("trace", {"x" : x, "y" : y})
+    assert len(source.data["x"]) <= 20
+    assert np.argmax(y) in source.data["x"]
+
+    #The view is shown in outline at full width, as is the rest of the trace
+    manager.set_view("trace", 100., 199.)
+    inside = (source.data["x"] >= 100.) & (source.data["x"] <= 199.)
+    assert 10 <= np.sum(inside) <= 20 and np.sum(~inside) <= 20
+    assert len(manager.read("trace")[0]) == 1000
+
+    #The source shows what the buffer holds, at the dtype it is stored as
+    manager.register({"short" : source}, depth = 4, dtype = np.float32)
+    manager.append("short", {"x" : np.arange(3.), "y" : np.arange(3.)})
+    manager.append("short", {"x" : np.arange(3.), "y" : np.arange(3., 6.)})
+    assert np.array_equal(source.data["y"], [3., 4., 5.]) and source.data["y"].dtype == np.float32
+
+
+def test_compile_plan_orders_and_classifies_steps():
+    from instrument import Instrument
+    inst = Instrument(FakeDevice(), None, "Maker", "Model")
+    plan = inst.compile_plan({
+        "y" : [{"inst" : "TRAC?"}, {"proc" : "lambda q : 2*q"}],
+        "init" : [{"inst" : "OUTP ON"}],
+        "on_change" : [{"inst" : "FREQ {}"}, {"exec" : "self.ran = True"}],
+        "x" : [{"unknown" : "ignored"}]})
+
+    assert [(k, kind) for k, condition, kind, action in plan] == [
+        ("init", "write"), ("on_change", "inst"), ("on_change", "exec"), ("y", "query"), ("y", "proc")]
+    assert plan[1][3](5, 4, "value") == "FREQ 5"
+
+    #Expressions and statements without fields are evaluated or compiled only once
+    assert plan[4][3](1, 0, "") is plan[4][3](2, 1, "")
+    assert plan[4][3](1, 0, "")(3) == 6
+    assert plan[2][3](1, 0, "") is plan[2][3](2, 1, "")
+
+
+def test_compile_plan_conditions():
+    from instrument import Instrument
+    inst = Instrument(FakeDevice(), None, "Maker", "Model")
+
+    condition = inst.compile_expression("{} > {}")
+    assert condition(2, 1, "value") and not condition(1, 2, "value")
+    condition = inst.compile_expression("{2} == 'active' and {0} != {1}")
+    assert condition(1, 0, "active") and not condition(1, 1, "active")
+
+    #Fields holding strings are compared as values, where they were once evaluated as names
+    condition = inst.compile_expression("{} == 'on'")
+    assert condition("on", "off", "value") and not condition("off", "on", "value")
+
+    #Fields with format specifications are formatted, then evaluated
+    condition = inst.compile_expression("{:.0f} == 2")
+    assert condition(2.4, 0, "value") and not condition(2.6, 0, "value")
+
+
+def test_bound_command_set_skips_steps_by_condition():
+    from instrument import Instrument
+    device = FakeDevice({"VOLT?" : 1.5})
+    inst = Instrument(device, None, "Maker", "Model")
+    method = inst.bind({"on_change" : [
+        {"condition" : "{} == 'on'", "inst" : "OUTP ON"},
+        {"condition" : "{} != 'on'", "inst" : "OUTP OFF"},
+        {"inst" : "VOLT?"}]})
+
+    assert method("value", "off", "on") == {}
+    method("value", "on", "off")
+    assert device.log == [("write", "OUTP ON"), ("query", "VOLT?"), ("write", "OUTP OFF"), ("query", "VOLT?")]
+
+
+def test_exec_statements_see_the_last_query_and_streamed_values():
+    from instrument import Instrument
+    inst = Instrument(FakeDevice({"TRAC?" : np.arange(3.)}), None, "Maker", "Model")
+    method = inst.bind({"on_change" : [{"query" : "TRAC?"}, {"exec" : "to_stream['x'] = np.arange(len(last_query)) + {}"}]})
+    assert np.array_equal(method("value", 0, 10)["x"], [10, 11, 12])
+
+    #Statements without fields are compiled once, and see the same names
+    method = inst.bind({"y" : [{"query" : "TRAC?"}, {"exec" : "to_stream['x'] = 2*last_query"}]})
+    streamed = method()
+    assert np.array_equal(streamed["x"], [0., 2., 4.])
+    assert np.array_equal(streamed["y"], [0., 1., 2.])
+
+
+def test_poll_makes_identical_queries_once():
+    from instrument import Instrument
+    device = FakeDevice({"TRAC?" : np.arange(3.), "FREQ?" : np.arange(3., 6.)})
+    inst = Instrument(device, None, "Maker", "Model")
+    for name, command_set in (
+            ("trace", {"y" : [{"query" : "TRAC?"}], "x" : [{"query" : "FREQ?"}]}),
+            ("double", {"y" : [{"query" : "TRAC?"}, {"proc" : "lambda q : 2*q"}]}),
+            ("broken", {"y" : [{"query" : "MISSING?"}]})):
+        inst.operations["monitors:" + name] = inst.bind(command_set)
+
+    results = inst.poll(["monitors:trace", "monitors:double", "monitors:broken"])
+
+    assert device.log.count(("query", "TRAC?")) == 1 and device.log.count(("query", "FREQ?")) == 1
+    assert np.array_equal(results["monitors:trace"]["x"], [3., 4., 5.])
+    assert np.array_equal(results["monitors:double"]["y"], [0., 2., 4.])
+    assert isinstance(results["monitors:broken"], KeyError)
+
+    #Each poll makes its queries afresh
+    inst.poll(["monitors:trace", "monitors:double"])
+    assert device.log.count(("query", "TRAC?")) == 2
+
+
+def test_instrument_worker_runs_operations_in_order():
+    from instrument import Instrument
+    device = FakeDevice()
+    inst = Instrument(device, None, "Maker", "Model")
+    inst.operations["settings:freq"] = inst.bind({"on_change" : [{"inst" : "FREQ {}"}]})
+
+    gate = Event()
+    inst.submit(gate.wait)
+    futures = [inst.submit("settings:freq", "value", k, k + 1) for k in range(5)]
+    assert inst.busy() and inst.pending == 6 and device.log == []
+
+    gate.set()
+    for future in futures:
+        future.result()
+
+    #Closing lets the queued operations finish, then closes the device
+    inst.close()
+    inst.worker.shutdown(wait = True)
+    assert not inst.busy()
+    assert device.log == [("write", "FREQ " + str(k)) for k in range(1, 6)] + [("close", None)]
+    with raises(RuntimeError):
+        inst.submit("settings:freq", "value", 0, 1)
+
+
+def test_poll_scheduler_skips_polls_while_busy():
+    from instrument import Instrument
+    from poll_scheduler import PollScheduler
+    inst = Instrument(FakeDevice({"TRAC?" : np.arange(3.)}), None, "Maker", "Model")
+    inst.operations["monitors:trace"] = inst.bind({"y" : [{"query" : "TRAC?"}]})
+
+    dispatched = []
+    def dispatch(operation, callback, *args):
+        dispatched.append(args)
+        callback(operation(*args))
+
+    scheduler = PollScheduler(types.SimpleNamespace(inst = inst, dispatch = dispatch, report = None))
+    scheduler.doc = FakeDocument()
+    results = []
+    scheduler.enable("monitors:trace", 10000, results.append)
+    assert scheduler.doc.callbacks == [(scheduler.tick, 10000)]
+
+    #A poll due while another operation is pending is left for the next tick
+    gate = Event()
+    inst.submit(gate.wait)
+    scheduler.tick()
+    assert dispatched == [] and results == []
+
+    gate.set()
+    inst.worker.submit(lambda : None).result()
+    scheduler.tick()
+    assert dispatched == [(["monitors:trace"],)]
+    assert np.array_equal(results[0]["y"], [0., 1., 2.])
+
+    #It is then not due again until its interval has passed
+    scheduler.tick()
+    assert len(dispatched) == 1
+
+    scheduler.stop()
+    assert scheduler.doc.callbacks == []
+
+
+def test_transport_casts_only_where_needed():
+    from data_manager import transport
+    values = np.linspace(0, 1, 5)
+    sent = transport(values, np.float32)
+    assert sent.dtype == np.float32 and np.array_equal(sent, values.astype(np.float32))
+
+    #Arrays already of the requested dtype are sent as they are
+    assert np.shares_memory(transport(sent, np.float32), sent)
+    assert np.shares_memory(transport(values), values)
+    assert np.shares_memory(transport(values, np.float64), values)
+
+    #Complex values are not truncated to a real dtype
+    values = np.array([1 + 2j, 3 - 4j])
+    assert transport(values, np.float32).dtype == np.complex128
+
+    #Big-endian values, as some instruments send them, are converted to native byte order
+    values = np.arange(4., dtype = ">f8")
+    for dtype in (None, np.float64, np.float32):
+        sent = transport(values, dtype)
+        assert sent.dtype.isnative and np.array_equal(sent, [0., 1., 2., 3.])
+    assert transport(values).dtype == np.float64
+
+
+def test_network_analyser_driver_reads_little_endian_doubles(monkeypatch):
+    from instrument import Instrument
+    device = FakeDevice()
+    device.query_binary_values = lambda command, **kwargs : kwargs
+    inst = Instrument(device, None, "Agilent Technologies", "N5224A", "MY51441489", "A-10-00-00")
+
+    #Driver files are found relative to the root of the repository
+    monkeypatch.chdir(os.path.join(os.path.dirname(__file__), '..'))
+    assert inst.load_config(report = messages.append)
+
+    assert inst.query("CALC:DATA? FDATA") == {"datatype" : "d", "is_big_endian" : False, "container" : np.ndarray}
+    assert device.log.index(("write", "FORM:DATA REAL,64")) < device.log.index(("write", "FORM:BORD SWAP"))
+    for name in ("Log Magnitude", "Phase"):
+        assert inst.config["monitors"][name]["dtype"] == {"y" : "float32"}
+
+
+def test_probe_ports_delivers_every_port_that_answers(monkeypatch, tmp_path):
+    import time
+    from instrument import Instrument
+    from discovery import probe_ports
+
+    class FakePort(FakeDevice):
+        def __init__(self, idn = None, delay = 0):
+            super().__init__()
+            self.idn, self.delay, self.timeout = idn, delay, 5000
+
+        def query(self, command):
+            time.sleep(self.delay)
+            if self.idn is None:
+                raise TimeoutError("Timeout expired before operation completed")
+            return self.idn
+
+    devices = {"GPIB::1" : FakePort("Maker,Model,1,1.0"), "GPIB::2" : FakePort(delay = 0.2),
+               "GPIB::4" : FakePort("Broken,Model,1,1.0")}
+    class FakeResourceManager:
+        def list_resources(self):
+            return ("GPIB::1", "GPIB::2", "GPIB::3", "GPIB::4")
+
+        def open_resource(self, port, open_timeout):
+            if port not in devices:
+                raise OSError("Unable to open " + port)
+            return devices[port]
+
+    load_config = Instrument.load_config
+    def failing_load_config(self, report):
+        if self.idn[0] == "Broken":
+            raise RuntimeError("Driver failed to load")
+        return load_config(self, report)
+    monkeypatch.setattr(Instrument, "load_config", failing_load_config)
+    monkeypatch.chdir(tmp_path)
+
+    delivered = []
+    assert probe_ports(FakeResourceManager(), 100, None, lambda port, future : delivered.append((port, future))) == 4
+
+    #Every port is delivered, the one that timed out last, and only the instrument that answered is kept open
+    assert sorted(port for port, _ in delivered) == ["GPIB::1", "GPIB::2", "GPIB::3", "GPIB::4"]
+    assert delivered[-1][0] == "GPIB::2"
+    results = dict(delivered)
+    inst, config_messages = results["GPIB::1"].result()
+    assert inst.device is devices["GPIB::1"] and inst.idn == ("Maker", "Model", "1", "1-0")
+    assert len(config_messages) == 1 and "instrument.cfg was not found" in config_messages[0]
+    assert devices["GPIB::1"].timeout == 5000
+    assert isinstance(results["GPIB::2"].exception(), TimeoutError)
+    assert isinstance(results["GPIB::3"].exception(), OSError)
+    assert isinstance(results["GPIB::4"].exception(), RuntimeError)
+    assert [("close", None) in devices[port].log for port in ("GPIB::1", "GPIB::2", "GPIB::4")] == [False, True, True]